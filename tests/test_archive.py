@@ -0,0 +1,66 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+
+# time-clock.py isn't an importable module name, so load it from its path
+spec = importlib.util.spec_from_file_location('time_clock', os.path.join(os.path.dirname(__file__), '..', 'time-clock.py'))
+time_clock = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(time_clock)
+
+def make_shift(emp_id, date, start, end=None, breaks=(), lunches=()):
+    shift = time_clock.Shift(emp_id, date, start)
+    shift.shift_end = time_clock.time_value(date, end)
+    shift.breaks = [time_clock.Break(time_clock.time_value(date, brk_start), time_clock.time_value(date, brk_end))
+        for brk_start, brk_end in breaks]
+    shift.lunches = [time_clock.Lunch(time_clock.time_value(date, lunch_start), time_clock.time_value(date, lunch_end))
+        for lunch_start, lunch_end in lunches]
+    return shift
+
+class PackShiftTest(unittest.TestCase):
+    def test_round_trip(self):
+        shifts = [make_shift('12345', '01/08/24', '08:00:00', '16:30:00', breaks=[('10:00:00', '10:15:00')],
+                lunches=[('12:00:00', '12:30:00')]),
+            make_shift('12345', '01/09/24', '08:00:00', breaks=[('10:00:00', None)])]
+        packed = b''.join(time_clock.pack_shift(shift) for shift in shifts)
+        unpacked = list(time_clock.unpack_shifts('12345', packed, len(shifts)))
+        self.assertEqual([shift.to_dict() for shift in unpacked], [shift.to_dict() for shift in shifts])
+
+    def test_unparsed_time_is_not_packed(self):
+        # Times that couldn't be parsed are kept as strings, which have no packed form
+        shift = make_shift('12345', '01/08/24', '08:00:00', 'half past four')
+        self.assertEqual(time_clock.pack_shift(shift), None)
+
+class ArchiveFileTest(unittest.TestCase):
+    def setUp(self):
+        self.old_directory = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        self.storage = time_clock.JsonStorage()
+        self.shifts = [make_shift('12345', '01/08/24', '08:00:00', '16:00:00', lunches=[('12:00:00', '12:30:00')]),
+            make_shift('12345', '01/09/24', '08:00:00', '16:00:00'),
+            make_shift('23456', '01/08/24', '09:00:00', '17:00:00', breaks=[('11:00:00', '11:10:00')]),
+            # Goes in the extras section
+            make_shift('23456', '01/09/24', '09:00:00', 'late')]
+        self.storage.write_archive('2024-01', time_clock.pack_archive(self.shifts))
+
+    def tearDown(self):
+        os.chdir(self.old_directory)
+        self.directory.cleanup()
+
+    def test_every_shift_read_back(self):
+        archived = sorted((shift.to_dict() for shift in self.storage.read_archive('2024-01')),
+            key=lambda shift: (shift['emp_id'], shift['date']))
+        self.assertEqual(archived, [shift.to_dict() for shift in self.shifts])
+
+    def test_one_employees_shifts_read_back(self):
+        for emp_id in ['12345', '23456']:
+            archived = [shift.to_dict() for shift in self.storage.read_archive('2024-01', emp_id)]
+            self.assertEqual(sorted(archived, key=lambda shift: shift['date']),
+                [shift.to_dict() for shift in self.shifts if shift.emp_id == emp_id])
+
+    def test_missing_month_reads_nothing(self):
+        self.assertEqual(list(self.storage.read_archive('2023-12')), [])
+
+if __name__ == '__main__':
+    unittest.main()
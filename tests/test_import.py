@@ -0,0 +1,76 @@
+import datetime
+import importlib.util
+import os
+import tempfile
+import unittest
+
+# time-clock.py isn't an importable module name, so load it from its path
+spec = importlib.util.spec_from_file_location('time_clock', os.path.join(os.path.dirname(__file__), '..', 'time-clock.py'))
+time_clock = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(time_clock)
+
+def punch(emp_id, action, date, time):
+    return {'emp_id': emp_id, 'action': action, 'date': date, 'time': time}
+
+class ApplyPunchesTest(unittest.TestCase):
+    def setUp(self):
+        self.old_directory = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        # apply_punches() works on the module's store, loaded with the mock data
+        time_clock.store = time_clock.TimeClockStore()
+        time_clock.get_employee_data()
+
+    def tearDown(self):
+        time_clock.close_data_file()
+        os.chdir(self.old_directory)
+        self.directory.cleanup()
+
+    def test_backfilled_shift_is_recorded_in_time_order(self):
+        rejected = time_clock.apply_punches([
+            punch('12345', 'end_shift', '01/08/24', '16:00:00'),
+            punch('12345', 'start_lunch', '01/08/24', '12:00:00'),
+            punch('12345', 'start_shift', '01/08/24', '08:00:00'),
+            punch('12345', 'end_lunch', '01/08/24', '12:30:00')])
+        self.assertEqual(rejected, [])
+        shift = time_clock.store.get_shift('12345', '01/08/24')
+        self.assertEqual(time_clock.format_time(shift.shift_end), '16:00:00')
+        self.assertEqual(len(shift.lunches), 1)
+
+    def test_backfill_leaves_current_status_alone(self):
+        time_clock.apply_punches([punch('12345', 'start_shift', '01/08/24', '08:00:00')])
+        self.assertFalse(time_clock.store.get_employee('12345').shift_active)
+        self.assertEqual(time_clock.store.active_employees(), [])
+
+    def test_todays_punch_changes_current_status(self):
+        today = datetime.date.today().strftime("%x")
+        time_clock.apply_punches([punch('12345', 'start_shift', today, '00:00:01')])
+        self.assertTrue(time_clock.store.get_employee('12345').shift_active)
+        self.assertEqual([entry['id'] for entry in time_clock.store.active_employees()], ['12345'])
+
+    def test_rule_breaking_punches_are_skipped(self):
+        rejected = time_clock.apply_punches([
+            punch('12345', 'end_shift', '01/08/24', '16:00:00'),
+            punch('00000', 'start_shift', '01/08/24', '08:00:00'),
+            punch('12345', 'clock_in', '01/08/24', '08:00:00'),
+            punch('12345', 'start_shift', '01/08/24', '25:00:00'),
+            punch('23456', 'start_shift', '01/08/24', '08:00:00'),
+            punch('23456', 'start_shift', '01/08/24', '09:00:00')])
+        self.assertEqual(rejected, [
+            (0, 'There is no shift for this employee on this date.'),
+            (1, 'Employee ID not valid.'),
+            (2, 'Unknown punch: clock_in'),
+            (3, 'Date or time not valid.'),
+            (5, 'There is already a shift for this employee on this date.')])
+
+    def test_rows_that_are_not_punches_are_skipped(self):
+        rejected = time_clock.apply_punches([
+            ['12345', 'start_shift', '01/08/24', '08:00:00'],
+            punch(['12345'], 'start_shift', '01/08/24', '08:00:00'),
+            punch('12345', 'start_shift', '01/08/24', 800),
+            punch('23456', 'start_shift', '01/08/24', '08:00:00')])
+        self.assertEqual(rejected, [(0, 'Not a punch.'), (1, 'emp_id must be a string.'), (2, 'time must be a string.')])
+        self.assertNotEqual(time_clock.store.get_shift('23456', '01/08/24'), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+
+# time-clock.py isn't an importable module name, so load it from its path
+spec = importlib.util.spec_from_file_location('time_clock', os.path.join(os.path.dirname(__file__), '..', 'time-clock.py'))
+time_clock = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(time_clock)
+
+class TornJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.old_directory = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+
+    def tearDown(self):
+        os.chdir(self.old_directory)
+        self.directory.cleanup()
+
+    def load(self):
+        store = time_clock.TimeClockStore()
+        storage = time_clock.JsonStorage()
+        storage.load(store)
+        store.storage = storage
+        return store, storage
+
+    def test_punches_after_torn_first_line_survive_restart(self):
+        # First run writes the mock data snapshot
+        store, storage = self.load()
+        storage.close()
+
+        # A crash leaves a partly written first record in the journal
+        with open(storage.journal_file_name, "w") as journal:
+            journal.write('{"shift": {"emp_id": "12345", "da')
+
+        store, storage = self.load()
+        shift = time_clock.Shift('12345', '01/08/24', '08:00:00')
+        store.add_shift(shift)
+        storage.save(store.get_employee('12345'), shift)
+        storage.close()
+
+        store, storage = self.load()
+        storage.close()
+        self.assertNotEqual(store.get_shift('12345', '01/08/24'), None)
+
+    def test_record_without_newline_is_kept(self):
+        store, storage = self.load()
+        storage.close()
+
+        # The last record was written whole, but its newline wasn't
+        employee = store.get_employee('12345')
+        employee.first_name = 'Johnny'
+        with open(storage.journal_file_name, "w") as journal:
+            journal.write(storage.journal_line(employee).rstrip('\n'))
+
+        store, storage = self.load()
+        storage.close()
+        self.assertEqual(store.get_employee('12345').first_name, 'Johnny')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import contextlib
+import importlib.util
+import io
+import os
+import tempfile
+import unittest
+
+# time-clock.py isn't an importable module name, so load it from its path
+spec = importlib.util.spec_from_file_location('time_clock', os.path.join(os.path.dirname(__file__), '..', 'time-clock.py'))
+time_clock = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(time_clock)
+
+class MergeSitesTest(unittest.TestCase):
+    def setUp(self):
+        self.old_directory = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+
+    def tearDown(self):
+        os.chdir(self.old_directory)
+        self.directory.cleanup()
+
+    def load(self, directory):
+        store = time_clock.TimeClockStore()
+        storage = time_clock.JsonStorage(directory=directory)
+        storage.load(store)
+        store.storage = storage
+        return store, storage
+
+    def record_shift(self, directory, shift_start):
+        """ Record a shift for employee 12345 on 01/08/24 in a directory's data. """
+        os.makedirs(directory or '.', exist_ok=True)
+        store, storage = self.load(directory)
+        shift = time_clock.Shift('12345', '01/08/24', shift_start)
+        store.add_shift(shift)
+        storage.save(store.get_employee('12345'), shift)
+        storage.close()
+
+    def merge(self, sites, directory=''):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return time_clock.merge_sites(sites, directory)
+
+    def merged_shift_start(self, directory=''):
+        store, storage = self.load(directory)
+        storage.close()
+        return time_clock.format_time(store.get_shift('12345', '01/08/24').shift_start)
+
+    def test_first_site_listed_wins_a_conflict(self):
+        self.record_shift(time_clock.site_directory('A'), '08:00:00')
+        self.record_shift(time_clock.site_directory('B'), '09:00:00')
+        self.assertEqual(self.merge(['B', 'A']), 1)
+        self.assertEqual(self.merged_shift_start(), '09:00:00')
+
+    def test_same_shift_at_two_sites_is_not_a_conflict(self):
+        self.record_shift(time_clock.site_directory('A'), '08:00:00')
+        self.record_shift(time_clock.site_directory('B'), '08:00:00')
+        self.assertEqual(self.merge(['A', 'B']), 0)
+        self.assertEqual(self.merged_shift_start(), '08:00:00')
+
+    def test_site_replaces_earlier_merge(self):
+        self.record_shift('', '07:00:00')
+        self.record_shift(time_clock.site_directory('A'), '08:00:00')
+        self.assertEqual(self.merge(['A']), 0)
+        self.assertEqual(self.merged_shift_start(), '08:00:00')
+
+    def test_target_site_keeps_its_own_shift(self):
+        site_a = time_clock.site_directory('A')
+        self.record_shift(site_a, '08:00:00')
+        self.record_shift(time_clock.site_directory('B'), '09:00:00')
+        self.assertEqual(self.merge(['B'], site_a), 1)
+        self.assertEqual(self.merged_shift_start(site_a), '08:00:00')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import contextlib
+import importlib.util
+import io
+import os
+import tempfile
+import unittest
+
+# time-clock.py isn't an importable module name, so load it from its path
+spec = importlib.util.spec_from_file_location('time_clock', os.path.join(os.path.dirname(__file__), '..', 'time-clock.py'))
+time_clock = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(time_clock)
+
+class ChecksumTest(unittest.TestCase):
+    def test_snapshot_round_trip(self):
+        body = b'{\n    "employees": []\n}'
+        self.assertEqual(time_clock.snapshot_body(time_clock.snapshot_with_checksum(body)), body)
+
+    def test_damaged_snapshot_is_spotted(self):
+        content = time_clock.snapshot_with_checksum(b'{\n    "employees": []\n}')
+        self.assertEqual(time_clock.snapshot_body(content.replace(b'[]', b'{}')), None)
+
+    def test_snapshot_without_checksum_is_read_as_it_is(self):
+        self.assertEqual(time_clock.snapshot_body(b'{"employees": []}'), b'{"employees": []}')
+
+class BackupRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.old_directory = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+
+    def tearDown(self):
+        os.chdir(self.old_directory)
+        self.directory.cleanup()
+
+    def load(self):
+        store = time_clock.TimeClockStore()
+        storage = time_clock.JsonStorage()
+        storage.load(store)
+        store.storage = storage
+        return store, storage
+
+    def punch_and_compact(self, days):
+        """ Record a shift on each day, writing a new snapshot after each one. """
+        for day in days:
+            store, storage = self.load()
+            shift = time_clock.Shift('12345', '01/' + str(day) + '/24', '08:00:00')
+            store.add_shift(shift)
+            storage.save(store.get_employee('12345'), shift)
+            storage.write_snapshot()
+            storage.close()
+
+    def damage(self, file_name):
+        with open(file_name, "r+b") as snapshot_file:
+            snapshot_file.seek(40)
+            snapshot_file.write(b'XX')
+
+    def test_backup_is_brought_up_to_date(self):
+        store, storage = self.load()
+        storage.close()
+        self.punch_and_compact([10, 11, 12])
+
+        self.damage('time_clock_data.json')
+        self.damage('time_clock_data.json.1')
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            store, storage = self.load()
+        storage.close()
+        self.assertIn('Loading time_clock_data.json.2 instead', output.getvalue())
+        self.assertNotIn('may be missing', output.getvalue())
+        for day in [10, 11, 12]:
+            self.assertNotEqual(store.get_shift('12345', '01/' + str(day) + '/24'), None)
+
+    def test_missing_journal_segment_is_reported(self):
+        store, storage = self.load()
+        storage.close()
+        self.punch_and_compact([10, 11])
+
+        os.remove(storage.journal_segment_name(max(storage.journal_segments())))
+        self.damage('time_clock_data.json')
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            store, storage = self.load()
+        storage.close()
+        self.assertIn('punches recorded since it was written may be missing', output.getvalue())
+
+    def test_never_falls_back_to_mock_data(self):
+        store, storage = self.load()
+        storage.close()
+        self.punch_and_compact([10])
+
+        snapshot_file_names = [file_name for file_name in storage.snapshot_file_names() if os.path.exists(file_name)]
+        for file_name in snapshot_file_names:
+            self.damage(file_name)
+        contents = {}
+        for file_name in snapshot_file_names:
+            with open(file_name, "rb") as snapshot_file:
+                contents[file_name] = snapshot_file.read()
+
+        with self.assertRaises(ValueError):
+            self.load()
+        # The damaged files are left as they were, for someone to look at
+        for file_name in snapshot_file_names:
+            with open(file_name, "rb") as snapshot_file:
+                self.assertEqual(snapshot_file.read(), contents[file_name])
+
+if __name__ == '__main__':
+    unittest.main()
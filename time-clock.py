@@ -1,7 +1,8 @@
 #####################################################################################
 #  TIME CLOCK APPLICATION                                                           #
 #                                                                                   #
-#  In the absence of a database, we store data in a json data file.                 #
+#  By default we store data in a json data file. Run with --storage sqlite to      #
+#  keep it in a SQLite database instead (--migrate-to-sqlite imports the json).     #
 #  Each employee 'record' is an instance of the Employee class.                     #
 #  Each shift 'record' is an instance of the Shift class. This program assumes      #
 #  one shift per day.                                                               #
@@ -9,13 +10,232 @@
 #  Since an employee can technically have multiple breaks and lunches during one    #
 #  shift, we have classes for those elements, and the instances are kept in         #
 #  lists in the Shift class.                                                        #
+#                                                                                   #
+#  Punches are appended to a journal file rather than rewriting the whole data      #
+#  file, and the journal is rolled into the data file (snapshot) periodically.      #
+#  Completed shifts older than a week are archived in one packed binary file per    #
+#  month and only read when they are needed, so startup time doesn't grow with      #
+#  history.                                                                         #
+#  Snapshots carry a checksum, and the last few are kept so a damaged data file     #
+#  can be recovered from the newest good one.                                       #
+#                                                                                   #
+#  Run with --serve to let many terminals share one time clock over HTTP.           #
+#  Run with --dashboard to watch who is clocked in.                                 #
+#  Run with --site NAME to keep a site's data in its own directory, and with        #
+#  --merge-sites to merge every site's data into one copy.                          #
+#  Run with --metrics-file to save punch and save timings, or --profile to profile. #
+#  Run with --benchmark to time punches, sign-ins, and reports against generated    #
+#  data (--employees and --years set its size).                                     #
 #                                                                                   #                                                              # 
 #####################################################################################
 
+import argparse
+import array
+import atexit
+import bisect
+import concurrent.futures
+import cProfile
+import contextlib
+import csv
+import io
 import datetime
+import functools
+import heapq
+import itertools
+import http.server
 import json
+import os
+import pstats
+import random
+import resource
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.parse
+import urllib.request
+import zlib
+
+### METRICS ###
+# Every punch, load, and save is counted and timed, so a slow terminal can be checked to see
+# where its time goes. Dump the numbers with --metrics-file, the admin menu, or GET /metrics.
+
+class Metrics:
+    """ Operation counters and latency histograms. Recording a timing is a lock and a few
+        additions, so it is cheap enough to leave on all the time.
+    """
+    # Upper bounds of the latency histogram buckets, in seconds
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (name, label name, label value) -> count
+        self.counters = {}
+        # operation -> [count in each bucket..., count over the last bucket, total seconds]
+        self.histograms = {}
+
+    def count(self, name, label, value, amount=1):
+        key = (name, label, value)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, operation, seconds):
+        position = bisect.bisect_left(self.BUCKETS, seconds)
+        with self.lock:
+            histogram = self.histograms.get(operation)
+            if histogram == None:
+                histogram = self.histograms[operation] = [0] * (len(self.BUCKETS) + 1) + [0.0]
+            histogram[position] += 1
+            histogram[-1] += seconds
+
+    @contextlib.contextmanager
+    def timer(self, operation):
+        """ Time the code in a with block. """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(operation, time.perf_counter() - started)
+
+    def timed(self, operation):
+        """ Decorator that times every call of a function, and counts the calls that return False. """
+        def decorator(function):
+            @functools.wraps(function)
+            def timed_function(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    result = function(*args, **kwargs)
+                finally:
+                    self.observe(operation, time.perf_counter() - started)
+                if result is False:
+                    self.count('failures', 'operation', operation)
+                return result
+            return timed_function
+        return decorator
+
+    def percentile(self, histogram, fraction):
+        """ Estimate a percentile from a histogram, as the upper bound of the bucket it falls in. """
+        rank = fraction * sum(histogram[:-1])
+        seen = 0
+        for position, bucket_count in enumerate(histogram[:-1]):
+            seen += bucket_count
+            if seen >= rank and bucket_count > 0:
+                return self.BUCKETS[position] if position < len(self.BUCKETS) else float('inf')
+        return 0.0
+
+    def as_dict(self):
+        with self.lock:
+            histograms = {operation: list(histogram) for operation, histogram in self.histograms.items()}
+            counters = dict(self.counters)
+        operations = {}
+        for operation, histogram in sorted(histograms.items()):
+            count = sum(histogram[:-1])
+            operations[operation] = {'count': count, 'total_seconds': histogram[-1],
+                'mean_seconds': histogram[-1] / count, 'p50_seconds': self.percentile(histogram, 0.5),
+                'p99_seconds': self.percentile(histogram, 0.99),
+                'buckets': dict(zip([str(bound) for bound in self.BUCKETS] + ['+Inf'], histogram[:-1]))}
+        return {'operations': operations,
+            'counters': [{'name': name, label: value, 'count': count} for (name, label, value), count in sorted(counters.items())]}
+
+    def as_text(self):
+        data = self.as_dict()
+        lines = ['OPERATION'.ljust(20) + 'COUNT'.rjust(10) + 'MEAN ms'.rjust(12) + 'p50 ms'.rjust(10) + 'p99 ms'.rjust(10) + 'TOTAL s'.rjust(10)]
+        for operation, timing in data['operations'].items():
+            lines.append(operation.ljust(20) + str(timing['count']).rjust(10) + format(timing['mean_seconds'] * 1000, '.3f').rjust(12) +
+                format(timing['p50_seconds'] * 1000, 'g').rjust(10) + format(timing['p99_seconds'] * 1000, 'g').rjust(10) +
+                format(timing['total_seconds'], '.3f').rjust(10))
+        for counter in data['counters']:
+            label = [key for key in counter if key not in ('name', 'count')][0]
+            lines.append(counter['name'] + ' (' + label + '=' + counter[label] + '): ' + str(counter['count']))
+        return '\n'.join(lines) + '\n'
+
+    def as_prometheus(self):
+        """ The metrics in the Prometheus text exposition format. """
+        with self.lock:
+            histograms = {operation: list(histogram) for operation, histogram in self.histograms.items()}
+            counters = dict(self.counters)
+        lines = ['# TYPE time_clock_operation_seconds histogram']
+        for operation, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, bucket_count in zip([str(bound) for bound in self.BUCKETS] + ['+Inf'], histogram[:-1]):
+                cumulative += bucket_count
+                lines.append('time_clock_operation_seconds_bucket{operation="' + operation + '",le="' + bound + '"} ' + str(cumulative))
+            lines.append('time_clock_operation_seconds_sum{operation="' + operation + '"} ' + repr(histogram[-1]))
+            lines.append('time_clock_operation_seconds_count{operation="' + operation + '"} ' + str(cumulative))
+        for name in sorted(set(key[0] for key in counters)):
+            lines.append('# TYPE time_clock_' + name + '_total counter')
+            for (counter_name, label, value), count in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append('time_clock_' + name + '_total{' + label + '="' + value + '"} ' + str(count))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, file_name):
+        """ Write the metrics to a file: json for .json files, Prometheus format for .prom files,
+            and a text table otherwise.
+        """
+        if file_name.endswith('.json'):
+            text = json.dumps(self.as_dict(), indent=4)
+        elif file_name.endswith('.prom'):
+            text = self.as_prometheus()
+        else:
+            text = self.as_text()
+        # Written to a temporary file and renamed, so a collector never reads half a file
+        with open(file_name + '.tmp', 'w') as metrics_file:
+            metrics_file.write(text)
+        os.replace(file_name + '.tmp', file_name)
+
+metrics = Metrics()
+
+def start_profiler(stats_file_name):
+    """ Profile the rest of the run with cProfile. At exit the stats are saved to a file (for
+        pstats or snakeviz) and the slowest functions are printed.
+    """
+    profiler = cProfile.Profile()
+
+    def stop_profiler():
+        profiler.disable()
+        profiler.dump_stats(stats_file_name)
+        print('\nProfile saved to', stats_file_name)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+
+    atexit.register(stop_profiler)
+    profiler.enable()
+
+### MODEL ###
+
+class Record:
+    """ Base class for employee, shift, break, and lunch records. Records keep their fields in
+        __slots__ rather than a per-object __dict__, which matters with years of shifts in memory.
+        They are only turned into dicts (keyed by field name) when written to storage or sent
+        to a terminal.
+    """
+    __slots__ = ()
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(record, name, data.get(name))
+        return record
+
+    # Records are pickled as a tuple of their fields, when sent between processes by merge_sites()
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+class Employee(Record):
+    __slots__ = ('id', 'first_name', 'last_name', 'is_admin', 'shift_active', 'at_lunch', 'on_break')
 
-class Employee:
     def __init__(self, emp_id, first_name, last_name):
         self.id = emp_id
         self.first_name = first_name
@@ -26,366 +246,2148 @@ class Employee:
         self.on_break = False;
 
 
-class Shift:
+class Shift(Record):
+    """ Shift, break, and lunch times are held as epoch seconds (see time_value()), and only
+        turned back into "%X" strings to be shown or stored.
+    """
+    __slots__ = ('emp_id', 'date', 'day', 'shift_start', 'shift_end', 'breaks', 'lunches')
+
     def __init__(self, emp_id, date, shift_start=None):
         self.emp_id = emp_id
-        self.date = date
-        self.shift_start = shift_start
+        # Every shift worked on a day shares one copy of the date string
+        self.date = sys.intern(date)
+        # Day number of the date, for sorting and range checks without parsing the date again
+        self.day = date_sort_key(date)
+        self.shift_start = time_value(date, shift_start)
         self.shift_end = None
         self.breaks = []
         self.lunches = []
 
-class Lunch:
+    def to_dict(self):
+        return {'emp_id': self.emp_id, 'date': self.date, 'shift_start': format_time(self.shift_start),
+            'shift_end': format_time(self.shift_end), 'breaks': [brk.to_dict() for brk in self.breaks],
+            'lunches': [lunch.to_dict() for lunch in self.lunches]}
+
+    @classmethod
+    def from_dict(cls, data):
+        date = data['date']
+        shift = cls(data['emp_id'], date, data.get('shift_start'))
+        shift.shift_end = time_value(date, data.get('shift_end'))
+        shift.breaks = [Break(time_value(date, brk.get('break_start')), time_value(date, brk.get('break_end')))
+            for brk in data.get('breaks', [])]
+        shift.lunches = [Lunch(time_value(date, lunch.get('lunch_start')), time_value(date, lunch.get('lunch_end')))
+            for lunch in data.get('lunches', [])]
+        return shift
+
+    def __getstate__(self):
+        return (self.emp_id, self.date, self.day, self.shift_start, self.shift_end,
+            tuple((brk.break_start, brk.break_end) for brk in self.breaks),
+            tuple((lunch.lunch_start, lunch.lunch_end) for lunch in self.lunches))
+
+    def __setstate__(self, state):
+        self.emp_id, date, self.day, self.shift_start, self.shift_end, breaks, lunches = state
+        self.date = sys.intern(date)
+        self.breaks = [Break(start, end) for start, end in breaks]
+        self.lunches = [Lunch(start, end) for start, end in lunches]
+
+class Lunch(Record):
+    __slots__ = ('lunch_start', 'lunch_end')
+
     def __init__(self, start=None, end=None):
         self.lunch_start = start
         self.lunch_end = end
 
-class Break:
+    def to_dict(self):
+        return {'lunch_start': format_time(self.lunch_start), 'lunch_end': format_time(self.lunch_end)}
+
+class Break(Record):
+    __slots__ = ('break_start', 'break_end')
+
     def __init__(self, start=None, end=None):
         self.break_start = start
         self.break_end = end
 
-# Lists to simulate database tables for employees and recorded shifts
-employees = []
-shifts = []
+    def to_dict(self):
+        return {'break_start': format_time(self.break_start), 'break_end': format_time(self.break_end)}
+
+# Dates and times are parsed and formatted through these caches, since the same few strings
+# come up over and over: every shift worked on a day has the same date, many start at the same
+# time, and the same admin input or imported punch time is checked more than once.
+
+@functools.lru_cache(maxsize=4096)
+def date_sort_key(date):
+    """ Turn a date string (formatted with "%x") into a number that sorts in calendar order.
+        Dates that can't be parsed sort first.
+    """
+    try:
+        return datetime.datetime.strptime(date, "%x").toordinal()
+    except ValueError:
+        return 0
+
+@functools.lru_cache(maxsize=4096)
+def day_to_date(day):
+    """ Return the date string ("%x") of a day number. """
+    return datetime.date.fromordinal(day).strftime("%x")
+
+@functools.lru_cache(maxsize=65536)
+def parse_time(date, time):
+    """ Convert a date string ("%x") and time string ("%X") to epoch seconds. Raises ValueError
+        if they can't be parsed.
+    """
+    return int(datetime.datetime.strptime(date + ' ' + time, "%x %X").timestamp())
+
+def time_value(date, time):
+    """ Normalize a time in a shift on this date to epoch seconds. Times that are already epoch
+        seconds, and None, are kept as they are. So are strings that can't be parsed (from data
+        files edited by hand), so that nothing is lost.
+    """
+    if isinstance(time, str):
+        try:
+            return parse_time(date, time)
+        except ValueError:
+            return time
+    return time
+
+@functools.lru_cache(maxsize=65536)
+def format_time(time):
+    """ Return a time from a shift as a "%X" string, to be shown or stored. """
+    if isinstance(time, int):
+        return datetime.datetime.fromtimestamp(time).strftime("%X")
+    return time
+
+# Pay periods are two weeks long, counted from this date
+PAY_PERIOD_START = datetime.date(2022, 8, 1)
+PAY_PERIOD_DAYS = 14
+OVERTIME_HOURS_PER_WEEK = 40
+
+def name_key(name):
+    """ Return a name in the form it is indexed and searched by: lower case, single spaces. """
+    return ' '.join(str(name).lower().split())
+
+def employee_name_keys(employee):
+    """ Return the names an employee can be found by: first, last, and full name either way round. """
+    first = name_key(employee.first_name)
+    last = name_key(employee.last_name)
+    return {key for key in [first, last, (first + ' ' + last).strip(), (last + ' ' + first).strip()] if key != ''}
+
+def week_start(day):
+    """ Return the day number of the Monday of the week holding this day number. """
+    # Day number 1 (January 1st of year 1) was a Monday
+    return day - (day - 1) % 7
+
+def pay_period_start(day):
+    """ Return the day number of the first day of the pay period holding this day number. """
+    return day - (day - PAY_PERIOD_START.toordinal()) % PAY_PERIOD_DAYS
+
+def totals_window_start(day):
+    """ Return the first day number whose totals are kept in memory: the start of this day's week
+        or pay period, whichever is earlier.
+    """
+    return min(week_start(day), pay_period_start(day))
+
+class TimeClockStore:
+    """ Simulates database tables for employees and recorded shifts.
+        Employees are indexed by id, shifts by (employee id, date), each employee's shifts are
+        also kept in a list sorted by date, and the shifts worked each day are indexed by day,
+        with the days kept in a sorted list. Every change goes through add_employee() or
+        add_shift() so the indexes always agree with each other, under index_lock, since server
+        threads and lazy loads from storage change them at the same time.
+        The store also keeps running totals of worked, break, and lunch seconds for each
+        employee by day, week, and pay period, so hours can be looked up without adding up shifts.
+        Only the current week and pay period are kept; totals for older days are worked out from
+        their shifts when asked for. There's also an index of the employees on the clock right now, kept up to date by the punches.
+        Employees can be looked up by the start of their name through a sorted index of names,
+        which is built when it is first needed after a change.
+    """
+    def __init__(self):
+        # Held while the employee and shift indexes are changed, or read more than one step at a time
+        self.index_lock = threading.RLock()
+        self.employees_by_id = {}
+        # Sorted (name key, emp_id) pairs for find_employees(), or None until it is next needed
+        self.name_index = None
+        self.shifts_by_emp_date = {}
+        self.shifts_by_emp = {}
+        # Day number -> {(emp_id, date): shift}, and the day numbers in that dict, sorted
+        self.shifts_by_day = {}
+        self.days = []
+        # (emp_id, 'day' | 'week' | 'period', first day number) -> [worked, break, lunch] seconds,
+        # for days from totals_first_day on
+        self.totals = {}
+        self.totals_first_day = totals_window_start(datetime.date.today().toordinal())
+        # emp_id -> status entry, for employees on the clock (see set_active_state())
+        self.active = {}
+        self.active_lock = threading.Lock()
+        # Counts changes to the active index, so watchers can tell when it needs writing out
+        self.active_version = 0
+        # Storage that can supply shifts which weren't loaded at startup
+        self.storage = None
+        # Employees whose whole shift history is in memory
+        self.loaded_employees = set()
+
+    def add_employee(self, employee):
+        """ Add an employee, or replace the employee with the same id. Call this again after
+            changing an employee's name, so the name index is rebuilt.
+        """
+        with self.index_lock:
+            self.employees_by_id[employee.id] = employee
+            # Loading adds every employee one at a time, so the index is sorted once, on first use
+            self.name_index = None
+
+    def get_employee(self, emp_id):
+        """ Return the employee with this id, or None. """
+        return self.employees_by_id.get(emp_id)
+
+    def unknown_emp_ids(self, emp_ids):
+        """ Return the ids in a batch (for example from a badge reader) that aren't an employee's. """
+        return [emp_id for emp_id in emp_ids if emp_id not in self.employees_by_id]
+
+    def find_employees(self, text, limit=None):
+        """ Return the employee whose id is the text, followed by the employees whose first name,
+            last name, or full name (either way round) starts with the text, in name order.
+            Case and extra spaces are ignored.
+        """
+        found = {}
+        employee = self.employees_by_id.get(text.strip())
+        if employee != None:
+            found[employee.id] = employee
+        prefix = name_key(text)
+        if prefix == '':
+            return list(found.values())
+
+        with self.index_lock:
+            name_index = self.name_index
+            if name_index == None:
+                name_index = sorted((key, employee.id) for employee in self.employees_by_id.values()
+                    for key in employee_name_keys(employee))
+                self.name_index = name_index
+        position = bisect.bisect_left(name_index, (prefix,))
+        while position < len(name_index) and (limit == None or len(found) < limit):
+            key, emp_id = name_index[position]
+            if not key.startswith(prefix):
+                break
+            if emp_id not in found:
+                found[emp_id] = self.employees_by_id[emp_id]
+            position += 1
+        return list(found.values())
+
+    def all_employees(self):
+        return list(self.employees_by_id.values())
+
+    def add_shift(self, shift):
+        """ Add a shift, or replace the shift for the same employee and date. """
+        key = (shift.emp_id, shift.date)
+        with self.index_lock:
+            emp_shifts = self.shifts_by_emp.setdefault(shift.emp_id, [])
+            old_shift = self.shifts_by_emp_date.get(key)
+            if old_shift != None:
+                emp_shifts[emp_shifts.index(old_shift)] = shift
+            else:
+                bisect.insort(emp_shifts, shift, key=lambda s: s.day)
+            self.shifts_by_emp_date[key] = shift
+
+            day_shifts = self.shifts_by_day.get(shift.day)
+            if day_shifts == None:
+                day_shifts = self.shifts_by_day[shift.day] = {}
+                bisect.insort(self.days, shift.day)
+            day_shifts[key] = shift
+
+    def add_stored_shift(self, shift):
+        """ Add a shift read from storage, unless the store already holds a copy of it (which may
+            have newer changes). Returns the shift in the store.
+        """
+        key = (shift.emp_id, shift.date)
+        with self.index_lock:
+            if key not in self.shifts_by_emp_date:
+                self.add_shift(shift)
+            return self.shifts_by_emp_date[key]
+
+    def get_shift(self, emp_id, date):
+        """ Return the shift for this employee on this date, or None. """
+        shift = self.shifts_by_emp_date.get((emp_id, date))
+        if shift == None and self.storage != None and emp_id not in self.loaded_employees:
+            shift = self.storage.load_shift(emp_id, date)
+            if shift != None:
+                shift = self.add_stored_shift(shift)
+        return shift
+
+    def get_employee_shifts(self, emp_id):
+        """ Return all of an employee's shifts, oldest first. """
+        if self.storage != None and emp_id not in self.loaded_employees:
+            for shift in self.storage.load_employee_shifts(emp_id):
+                self.add_stored_shift(shift)
+            self.loaded_employees.add(emp_id)
+        with self.index_lock:
+            return list(self.shifts_by_emp.get(emp_id, []))
+
+    def all_shifts(self):
+        with self.index_lock:
+            return list(self.shifts_by_emp_date.values())
+
+    def query_shifts(self, emp_ids=None, first_day=None, last_day=None, open_only=False, unfinished_only=False):
+        """ Yield the shifts that pass every filter given, ordered by day and then employee id.
+                emp_ids             only shifts worked by these employees
+                first_day, last_day only shifts on or between these day numbers
+                open_only           only shifts that haven't ended
+                unfinished_only     only shifts with a break or lunch that hasn't ended
+            Only the shifts on days in the range are looked at, so a report for last week doesn't
+            get slower as years of history pile up.
+        """
+        if first_day == None:
+            first_day = 0
+        if last_day == None:
+            last_day = datetime.date.max.toordinal()
+
+        if emp_ids != None:
+            # Each employee's shifts are sorted by day, so the range can be cut out of them
+            matches = []
+            for emp_id in sorted(set(emp_ids)):
+                # Only the employee's shifts in the range are read from storage, not their whole history
+                if self.storage != None and emp_id not in self.loaded_employees:
+                    for shift in self.storage.load_employee_shifts_between(emp_id, first_day, last_day):
+                        self.add_stored_shift(shift)
+                with self.index_lock:
+                    emp_shifts = list(self.shifts_by_emp.get(emp_id, []))
+                first = bisect.bisect_left(emp_shifts, first_day, key=lambda s: s.day)
+                last = bisect.bisect_right(emp_shifts, last_day, key=lambda s: s.day)
+                matches.append(emp_shifts[first:last])
+            shifts = heapq.merge(*matches, key=lambda s: (s.day, s.emp_id))
+        else:
+            # Open shifts are always in memory, but older shifts in the range may not be yet
+            if not open_only and self.storage != None:
+                for shift in self.storage.load_shifts_between(first_day, last_day):
+                    self.add_stored_shift(shift)
+            with self.index_lock:
+                first = bisect.bisect_left(self.days, first_day)
+                last = bisect.bisect_right(self.days, last_day)
+                days = self.days[first:last]
+            shifts = (shift for day in days for key, shift in self.day_shifts(day))
+
+        for shift in shifts:
+            if open_only and shift.shift_end != None:
+                continue
+            if unfinished_only and not (any(brk.break_end == None for brk in shift.breaks) or
+                    any(lunch.lunch_end == None for lunch in shift.lunches)):
+                continue
+            yield shift
+
+    def day_shifts(self, day):
+        """ Return the (key, shift) pairs of the shifts worked on a day, sorted by key. """
+        with self.index_lock:
+            return sorted(self.shifts_by_day[day].items())
+
+    def set_active_state(self, employee, shift):
+        """ Update the active index after a punch: employees on the clock are listed with their
+            status (working, on break, or at lunch), and dropped once their shift ends.
+        """
+        with self.active_lock:
+            if not employee.shift_active or shift == None:
+                self.active.pop(employee.id, None)
+            else:
+                status = 'working'
+                since = format_time(shift.shift_start)
+                if employee.on_break:
+                    status = 'on break'
+                    since = format_time(next((brk.break_start for brk in reversed(shift.breaks) if brk.break_end == None), None))
+                elif employee.at_lunch:
+                    status = 'at lunch'
+                    since = format_time(next((lunch.lunch_start for lunch in reversed(shift.lunches) if lunch.lunch_end == None), None))
+                self.active[employee.id] = {'id': employee.id, 'name': employee.first_name + ' ' + employee.last_name,
+                    'status': status, 'date': shift.date, 'shift_start': format_time(shift.shift_start), 'since': since}
+            self.active_version += 1
+
+    def rebuild_active_state(self):
+        """ Fill in the active index from the employees' status and their open shifts. """
+        for employee in self.employees_by_id.values():
+            open_shift = None
+            if employee.shift_active:
+                open_shift = next((shift for shift in reversed(self.shifts_by_emp.get(employee.id, []))
+                    if shift.shift_end == None), None)
+            self.set_active_state(employee, open_shift)
+
+    def active_employees(self):
+        """ Return the status entries of the employees on the clock, by id. Takes time in
+            proportion to the number of employees on the clock, not the size of the workforce.
+        """
+        with self.active_lock:
+            return sorted(self.active.values(), key=lambda entry: entry['id'])
+
+    def set_day_totals(self, emp_id, day, day_totals):
+        """ Set an employee's worked, break, and lunch seconds for a day, and adjust the totals for
+            that day's week and pay period by the difference. Days before the current week and pay
+            period aren't kept.
+        """
+        if day < self.totals_first_day:
+            return
+        old_totals = list(self.totals.get((emp_id, 'day', day), [0, 0, 0]))
+        for key in [(emp_id, 'day', day), (emp_id, 'week', week_start(day)), (emp_id, 'period', pay_period_start(day))]:
+            totals = self.totals.setdefault(key, [0, 0, 0])
+            for i in range(3):
+                totals[i] += day_totals[i] - old_totals[i]
+
+    def update_shift_totals(self, shift, old_shift_totals):
+        """ After a change to a shift, adjust its day's totals by how much the shift's totals changed. """
+        new_shift_totals = shift_totals(shift)
+        if new_shift_totals != old_shift_totals and shift.day >= self.totals_first_day:
+            day = shift.day
+            day_totals = self.get_totals(shift.emp_id, 'day', day)
+            self.set_day_totals(shift.emp_id, day,
+                [day_totals[i] + new_shift_totals[i] - old_shift_totals[i] for i in range(3)])
+
+    def get_totals(self, emp_id, period, day):
+        """ Return [worked, break, lunch] seconds for the 'day', 'week', or 'period' holding this day number. """
+        first_day = last_day = day
+        if period == 'week':
+            first_day = week_start(day)
+            last_day = first_day + 6
+        elif period == 'period':
+            first_day = pay_period_start(day)
+            last_day = first_day + PAY_PERIOD_DAYS - 1
+        if first_day >= self.totals_first_day:
+            return list(self.totals.get((emp_id, period, first_day), [0, 0, 0]))
+
+        # Older totals aren't kept, so add up the shifts, which come from storage if need be
+        totals = [0, 0, 0]
+        for shift in self.query_shifts(emp_ids=[emp_id], first_day=first_day, last_day=last_day):
+            for i, seconds in enumerate(shift_totals(shift)):
+                totals[i] += seconds
+        return totals
+
+    def all_day_totals(self):
+        """ Return {emp_id: [[day, worked, break, lunch], ...]} for every day with totals. """
+        day_totals = {}
+        for (emp_id, period, day), totals in self.totals.items():
+            if period == 'day' and totals != [0, 0, 0]:
+                day_totals.setdefault(emp_id, []).append([day] + totals)
+        return day_totals
+
+    def rebuild_totals(self, shifts):
+        """ Work out the kept days' totals from scratch, from these shifts. """
+        self.totals = {}
+        day_totals = {}
+        for shift in shifts:
+            key = (shift.emp_id, shift.day)
+            totals = day_totals.setdefault(key, [0, 0, 0])
+            for i, seconds in enumerate(shift_totals(shift)):
+                totals[i] += seconds
+        for (emp_id, day), totals in day_totals.items():
+            self.set_day_totals(emp_id, day, totals)
+
+# Simulated database tables for employees and recorded shifts
+store = TimeClockStore()
 
 # Keep track of current employee
 current_employee = None
 
-def get_employee_data():
-    """ Look for time_clock_data.json file and loads its data into 'employees' list and 'shifts' list.
-        If no data file exists (first program run), create file and populate with mock data,
-        then add data to 'employees' list and 'shifts' list.
-    """
-    with open("time_clock_data.json", "a+") as data_file:
-        data_file.seek(0)
-        if data_file.read() == "":
-            # create two mock employees
-            emp1 = Employee('12345', 'John', 'Doe').__dict__
-            emp2 = Employee('23456', 'Jane', 'Doe').__dict__
-            emp3 = Employee('99999', 'Admin', 'Person').__dict__
-            emp3['is_admin'] = True
-            # create some date/time objects for shifts
-            datetime1 = datetime.datetime(2022, 8, 10, 8, 0, 0)
-            datetime2 = datetime.datetime(2022, 8, 11, 8, 0, 0)
-            datetime3 = datetime.datetime(2022, 8, 12, 8, 0, 0)
-            # create some mock shifts
-            shift1 = Shift('12345', datetime1.strftime("%x"), datetime1.strftime("%X")).__dict__
-            shift2 = Shift('12345', datetime2.strftime("%x"), datetime1.strftime("%X")).__dict__
-            shift3 = Shift('23456', datetime3.strftime("%x"), datetime1.strftime("%X")).__dict__
-            # format data
-            mock_data = {'employees': [emp1, emp2, emp3],
-                         'shifts': [shift1, shift2, shift3]}
-            # add data to time_clock_data.json file
-            json.dump(mock_data, data_file, indent=4)
-            data_file.seek(0)
-            # append the mock data to 'employees' list and 'shifts' list
-            employees.append(emp1)
-            employees.append(emp2)
-            employees.append(emp3)
-            shifts.append(shift1)
-            shifts.append(shift2)
-            shifts.append(shift3)
+# Where the employee and shift data is kept (set up by get_employee_data())
+storage = None
+
+# Completed shifts older than this many days are only loaded from storage when needed
+RECENT_DAYS = 7
+
+def create_mock_data():
+    """ Create the mock employees and shifts used on the first program run.
+        Returns a list of employees and a list of shifts.
+    """
+    # create two mock employees
+    emp1 = Employee('12345', 'John', 'Doe')
+    emp2 = Employee('23456', 'Jane', 'Doe')
+    emp3 = Employee('99999', 'Admin', 'Person')
+    emp3.is_admin = True
+    # create some date/time objects for shifts
+    datetime1 = datetime.datetime(2022, 8, 10, 8, 0, 0)
+    datetime2 = datetime.datetime(2022, 8, 11, 8, 0, 0)
+    datetime3 = datetime.datetime(2022, 8, 12, 8, 0, 0)
+    # create some mock shifts
+    shift1 = Shift('12345', datetime1.strftime("%x"), datetime1.strftime("%X"))
+    shift2 = Shift('12345', datetime2.strftime("%x"), datetime1.strftime("%X"))
+    shift3 = Shift('23456', datetime3.strftime("%x"), datetime1.strftime("%X"))
+    return [emp1, emp2, emp3], [shift1, shift2, shift3]
+
+def date_month(date):
+    """ Return the "YYYY-MM" month of a date string (formatted with "%x"). """
+    return day_month(date_sort_key(date))
+
+def day_month(day):
+    """ Return the "YYYY-MM" month of a day number. """
+    if day == 0:
+        return 'unknown'
+    return datetime.date.fromordinal(day).strftime("%Y-%m")
+
+def is_recent_or_open(shift):
+    """ True for shifts still in progress or worked in the last RECENT_DAYS days. These are
+        the shifts loaded at startup; older shifts are loaded when they are asked for.
+    """
+    return shift.shift_end == None or shift.day >= datetime.date.today().toordinal() - RECENT_DAYS
+
+# Archived shifts are packed into binary records. Times are stored as epoch seconds and dates
+# as day numbers, and each archive file lists its employee ids once, with the position of each
+# employee's records, instead of repeating the id in every record:
+#   header         magic, number of employees, size of the records section, size of the extras section
+#   employee table for each employee: id length, id, offset of first record, number of records
+#   records        per shift: day, start, end, number of breaks, number of lunches,
+#                  then a start and end for each break and each lunch
+#   extras         json list of shifts whose dates or times couldn't be packed
+ARCHIVE_MAGIC = b'TCA1'
+ARCHIVE_HEADER = struct.Struct('<4sIQI')
+ARCHIVE_EMPLOYEE = struct.Struct('<QI')
+ARCHIVE_SHIFT = struct.Struct('<IqqHH')
+ARCHIVE_PERIOD = struct.Struct('<qq')
+NO_TIME = -2 ** 63
+
+def archive_time(time):
+    """ Return a shift's time as stored in the archive. Raises ValueError for a time that
+        couldn't be parsed.
+    """
+    if time == None:
+        return NO_TIME
+    if not isinstance(time, int):
+        raise ValueError('time can not be archived: ' + str(time))
+    return time
+
+def archived_time(epoch):
+    if epoch == NO_TIME:
+        return None
+    return epoch
+
+def shift_totals(shift):
+    """ Return [worked, break, lunch] seconds for a shift. Nothing is counted until the shift has
+        ended, and worked time is the shift's length less its finished breaks and lunches.
+    """
+    if shift.shift_end == None:
+        return [0, 0, 0]
+
+    def seconds(start, end):
+        # Missing times, and times that couldn't be parsed, don't count
+        if not isinstance(start, int) or not isinstance(end, int) or end <= start:
+            return 0
+        return end - start
+
+    break_seconds = sum(seconds(brk.break_start, brk.break_end) for brk in shift.breaks)
+    lunch_seconds = sum(seconds(lunch.lunch_start, lunch.lunch_end) for lunch in shift.lunches)
+    worked_seconds = seconds(shift.shift_start, shift.shift_end) - break_seconds - lunch_seconds
+    return [worked_seconds, break_seconds, lunch_seconds]
+
+def pack_shift(shift):
+    """ Pack a shift into an archive record, or return None if its dates or times can't be parsed. """
+    if shift.day == 0:
+        return None
+    try:
+        record = [ARCHIVE_SHIFT.pack(shift.day, archive_time(shift.shift_start),
+            archive_time(shift.shift_end), len(shift.breaks), len(shift.lunches))]
+        for brk in shift.breaks:
+            record.append(ARCHIVE_PERIOD.pack(archive_time(brk.break_start), archive_time(brk.break_end)))
+        for lunch in shift.lunches:
+            record.append(ARCHIVE_PERIOD.pack(archive_time(lunch.lunch_start), archive_time(lunch.lunch_end)))
+    except ValueError:
+        return None
+    return b''.join(record)
+
+def pack_archive(shifts):
+    """ Pack shifts into the contents of an archive file (see ARCHIVE_MAGIC). """
+    shifts_by_emp = {}
+    extras = []
+    for shift in shifts:
+        record = pack_shift(shift)
+        if record == None:
+            extras.append(shift)
+        else:
+            shifts_by_emp.setdefault(shift.emp_id, []).append((shift.day, record))
+
+    employee_table = []
+    records = []
+    records_size = 0
+    for emp_id in sorted(shifts_by_emp):
+        emp_records = [record for day, record in sorted(shifts_by_emp[emp_id])]
+        emp_id_bytes = emp_id.encode()
+        employee_table.append(struct.pack('<H', len(emp_id_bytes)) + emp_id_bytes +
+            ARCHIVE_EMPLOYEE.pack(records_size, len(emp_records)))
+        records.extend(emp_records)
+        records_size += sum(len(record) for record in emp_records)
+    extras_bytes = json.dumps([shift.to_dict() for shift in extras], separators=(',', ':')).encode() if extras else b''
+    return (ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, len(employee_table), records_size, len(extras_bytes)) +
+        b''.join(employee_table) + b''.join(records) + extras_bytes)
+
+def unpack_shifts(emp_id, data, count):
+    """ Unpack a run of one employee's archive records into shifts. """
+    offset = 0
+    for i in range(count):
+        day, start, end, break_count, lunch_count = ARCHIVE_SHIFT.unpack_from(data, offset)
+        offset += ARCHIVE_SHIFT.size
+        shift = Shift(emp_id, day_to_date(day), archived_time(start))
+        shift.shift_end = archived_time(end)
+        for j in range(break_count):
+            start, end = ARCHIVE_PERIOD.unpack_from(data, offset)
+            offset += ARCHIVE_PERIOD.size
+            shift.breaks.append(Break(archived_time(start), archived_time(end)))
+        for j in range(lunch_count):
+            start, end = ARCHIVE_PERIOD.unpack_from(data, offset)
+            offset += ARCHIVE_PERIOD.size
+            shift.lunches.append(Lunch(archived_time(start), archived_time(end)))
+        yield shift
+
+class GroupCommitWriter:
+    """ Commits changes to disk from a background thread, in groups. A caller of commit() waits
+        until the group holding its changes is durable, so a punch is only acknowledged once it
+        is safely stored, but punches arriving together (a rush at shift change) share one
+        fsync or transaction instead of each paying for their own.
+        While punches are arriving together, a group is committed when GROUP_MAX commits are
+        waiting or GROUP_WAIT seconds after the first of them arrived. A lone punch is committed
+        straight away.
+    """
+    GROUP_WAIT = 0.002
+    GROUP_MAX = 500
+
+    def __init__(self, commit_group, name):
+        # Function that durably commits a list of changes
+        self.commit_group = commit_group
+        self.condition = threading.Condition()
+        # Lists of changes waiting for the next group, one per commit() call
+        self.pending = []
+        # commit() calls numbered in arrival order; groups are committed in the same order
+        self.submitted = 0
+        self.committed = 0
+        # (first, last, exception) for groups that could not be committed
+        self.failures = []
+        self.last_group_size = 0
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def commit(self, changes):
+        """ Add changes to the next group and wait until it has been committed. Raises the
+            exception that stopped the group being committed, if there was one.
+        """
+        with self.condition:
+            self.pending.append(changes)
+            self.submitted += 1
+            ticket = self.submitted
+            self.condition.notify_all()
+            while self.committed < ticket:
+                self.condition.wait()
+            for first, last, error in self.failures:
+                if first <= ticket <= last:
+                    raise error
+
+    def run(self):
+        while True:
+            with self.condition:
+                while len(self.pending) == 0 and not self.stopping:
+                    self.condition.wait()
+                if len(self.pending) == 0:
+                    return
+                # When the last group had company, give other punches arriving at the same moment
+                # a chance to join this one
+                deadline = time.monotonic() + self.GROUP_WAIT
+                while self.last_group_size > 1 and len(self.pending) < self.GROUP_MAX and not self.stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                group = self.pending[:self.GROUP_MAX]
+                del self.pending[:len(group)]
+                self.last_group_size = len(group)
+                first = self.committed + 1
+
+            error = None
+            try:
+                with metrics.timer('group_commit'):
+                    self.commit_group([change for changes in group for change in changes])
+            except Exception as exception:
+                error = exception
+            # Commits per group is grouped_commits / group_commits
+            metrics.count('group_commits', 'writer', self.thread.name)
+            metrics.count('grouped_commits', 'writer', self.thread.name, len(group))
+
+            with self.condition:
+                self.committed = first + len(group) - 1
+                if error != None:
+                    self.failures.append((first, self.committed, error))
+                self.condition.notify_all()
+
+    def stop(self):
+        """ Commit anything still waiting, then end the writer thread. """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join()
+
+def fsync_directory(directory):
+    """ Force a directory's entries to disk, so files just renamed or removed in it stay that
+        way after a power loss.
+    """
+    # Directories can't be opened for fsync on every platform (Windows)
+    if hasattr(os, 'O_DIRECTORY'):
+        directory_fd = os.open(directory or '.', os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+# Snapshots start with a CRC-32 of the rest of the file, as the first key of the json object:
+#   {"checksum": "<8 hex digits>", "employees": ...
+# The checksum covers the snapshot as it would be written without that key, so a torn or
+# damaged file can be spotted without parsing it, and the file is still plain json.
+SNAPSHOT_CHECKSUM_PREFIX = b'{\n    "checksum": "'
+SNAPSHOT_CHECKSUM_SIZE = 8
+
+def snapshot_with_checksum(body):
+    """ Add the checksum key to a snapshot's json text (bytes). """
+    checksum = format(zlib.crc32(body), '08x').encode()
+    return SNAPSHOT_CHECKSUM_PREFIX + checksum + b'",' + body[1:]
+
+def snapshot_body(content):
+    """ Return a snapshot's json text without its checksum key, or None if the checksum doesn't
+        match. Snapshots from older versions have no checksum and are returned as they are.
+    """
+    if not content.startswith(SNAPSHOT_CHECKSUM_PREFIX):
+        return content
+    checksum_end = len(SNAPSHOT_CHECKSUM_PREFIX) + SNAPSHOT_CHECKSUM_SIZE
+    body = b'{' + content[checksum_end + 2:]
+    if content[len(SNAPSHOT_CHECKSUM_PREFIX):checksum_end] != format(zlib.crc32(body), '08x').encode():
+        return None
+    return body
+
+class JsonStorage:
+    """ Keeps data as a snapshot of every employee and open or recent shift in a json data file,
+        plus an append-only journal of the changes made since that snapshot was written.
+        Once the journal gets long it is rolled over into a numbered segment
+        (time_clock_journal.1.jsonl, ...) and a new snapshot holding it is written from another
+        thread, while punches carry on into a new journal file. Each snapshot records the first
+        segment it doesn't hold, so the segments from there on are replayed on top of it.
+        Segments are kept until every backup snapshot holds them, so a backup loaded in place
+        of a damaged data file is brought up to date too.
+        Older, completed shifts are archived in one packed binary file per month, and are only
+        read when a shift from that month (or an employee's whole history) is needed.
+        The last few snapshots are kept as time_clock_data.json.1, .2, ..., and if the data
+        file is lost or damaged the newest good one of them is loaded instead.
+        Files are kept in the current directory, or in the directory given (a site's directory).
+    """
+    COMPACT_EVERY = 1000    # journal records kept before rolling them into a new snapshot
+    SNAPSHOTS_KEPT = 3      # older snapshots kept as backups
+
+    def __init__(self, data_file_name="time_clock_data.json", journal_file_name="time_clock_journal.jsonl",
+        archive_dir_name="time_clock_archive", directory=''):
+        self.data_file_name = os.path.join(directory, data_file_name)
+        self.journal_file_name = os.path.join(directory, journal_file_name)
+        self.archive_dir_name = os.path.join(directory, archive_dir_name)
+        self.journal_file = None
+        self.journal_records = 0
+        # Number the journal gets when it is rolled over into a segment (worked out when first needed)
+        self.journal_segment = None
+        # First journal segment the newest snapshot written doesn't hold, and the same for each
+        # backup snapshot behind it (0 when not known, which keeps every segment)
+        self.snapshot_segment = 0
+        self.backup_segments = []
+        # Background thread appending journal records (started by the first save)
+        self.writer = None
+        # Background thread writing a snapshot after the journal was rolled over
+        self.compactor = None
+        self.store = None
+        # Archive months read into the store so far
+        self.loaded_months = set()
+        # Shifts in the store that are unchanged since they were read from the archive
+        self.archived_shifts = set()
+        # Punches can arrive from several threads in server mode
+        self.lock = threading.RLock()
+        # The journal file is appended to while a snapshot is being written
+        self.journal_lock = threading.RLock()
+        # Snapshots are written one at a time
+        self.snapshot_lock = threading.Lock()
+
+    def load(self, store):
+        """ Look for the data file and load its employees and shifts into the store.
+            If no data file exists (first program run), create file and populate with mock data.
+            If the data file is missing, empty, or damaged, the newest good backup snapshot is
+            loaded instead. Any punches recorded in the journal segments and journal since the
+            snapshot loaded are replayed on top of it, then rolled into a fresh snapshot.
+        """
+        self.store = store
+        first_run = False
+        needs_archiving = False
+        # Snapshots from older versions have no journal segments after them
+        first_segment = 1
+        snapshot_file_name, imported_data = self.read_newest_snapshot()
+        if imported_data == None:
+            first_run = True
+            mock_employees, mock_shifts = create_mock_data()
+            for employee in mock_employees:
+                store.add_employee(employee)
+            for shift in mock_shifts:
+                store.add_shift(shift)
         else:
-            data_file.seek(0)
-            imported_data = json.loads(data_file.read())
+            if snapshot_file_name != self.data_file_name:
+                print('\nWARNING:', self.data_file_name, 'is missing or damaged. Loading', snapshot_file_name, 'instead.')
+                # Set a damaged data file aside rather than keeping it as a backup
+                if os.path.exists(self.data_file_name):
+                    os.replace(self.data_file_name, self.data_file_name + '.damaged')
+                needs_archiving = True
+            first_segment = imported_data.get('journal_segment', 1)
+            self.backup_segments = imported_data.get('backup_journal_segments', [])
             for employee in imported_data['employees']:
-                employees.append(employee)
-            for shift in imported_data['shifts']:
-                shifts.append(shift)
+                store.add_employee(Employee.from_dict(employee))
+            for shift_data in imported_data['shifts']:
+                shift = Shift.from_dict(shift_data)
+                store.add_shift(shift)
+                # Data files from older versions hold every shift ever worked
+                if not is_recent_or_open(shift):
+                    needs_archiving = True
+            for emp_id, emp_day_totals in imported_data.get('totals', {}).items():
+                for day, worked_seconds, break_seconds, lunch_seconds in emp_day_totals:
+                    store.set_day_totals(emp_id, day, [worked_seconds, break_seconds, lunch_seconds])
+
+        self.snapshot_segment = first_segment
+        segments = self.journal_segments()
+        self.journal_segment = max([first_segment] + [segment + 1 for segment in segments])
+        if imported_data != None and snapshot_file_name != self.data_file_name:
+            # A backup is brought up to date by the journal segments after it, if they are all still
+            # there. Each newer snapshot rolled the journal over into at least one of them
+            backup_number = snapshot_file_name.rsplit('.', 1)[-1]
+            last_segment = first_segment + (int(backup_number) if backup_number.isdigit() else 0)
+            missing = [segment for segment in range(first_segment, max(self.journal_segment, last_segment))
+                if segment not in segments]
+            if 'journal_segment' not in imported_data or len(missing) > 0:
+                print('\nWARNING: the journal written after', snapshot_file_name, 'is not all there, so punches '
+                    'recorded since it was written may be missing. Check recent shifts.')
+        replayed = self.replay_journals(first_segment)
+        # Data files from older versions have no running totals, so work them out once
+        if not first_run and 'totals' not in imported_data:
+            store.rebuild_totals(self.all_shifts())
+            needs_archiving = True
+
+        # Write the mock data to a new data file, or roll any journaled punches into the snapshot
+        if replayed > 0 or first_run or needs_archiving:
+            self.write_snapshot()
+
+    def snapshot_file_names(self):
+        """ Return the snapshot files to try loading, newest first. A temporary file is only left
+            behind by a crash after it was fully written, so it is newer than every backup.
+        """
+        return ([self.data_file_name, self.data_file_name + '.tmp'] +
+            [self.data_file_name + '.' + str(i) for i in range(1, self.SNAPSHOTS_KEPT + 1)])
+
+    def read_newest_snapshot(self):
+        """ Return the file name and contents of the newest snapshot that is whole and undamaged.
+            Checksums are checked before parsing, so damaged files are skipped without reading
+            them as json. Returns (None, None) on the first program run, when there is no snapshot.
+        """
+        damaged = []
+        for file_name in self.snapshot_file_names():
+            try:
+                with open(file_name, "rb") as snapshot_file:
+                    content = snapshot_file.read()
+            except FileNotFoundError:
+                continue
+            if content.strip() == b'':
+                damaged.append(file_name)
+                continue
+            body = snapshot_body(content)
+            if body != None:
+                try:
+                    return file_name, json.loads(body)
+                except ValueError:
+                    pass
+            damaged.append(file_name)
+
+        # Never start over with mock data when there was data, even if none of it can be read
+        if any(os.path.getsize(file_name) > 0 for file_name in damaged if not file_name.endswith('.tmp')):
+            raise ValueError('No undamaged snapshot found (tried ' + ', '.join(damaged) + '). '
+                'The files have been left as they are.')
+        return None, None
+
+    def journal_segment_name(self, segment):
+        root, extension = os.path.splitext(self.journal_file_name)
+        return root + '.' + str(segment) + extension
+
+    def journal_segments(self):
+        """ Return the numbers of the journal segments on disk, oldest first. """
+        directory = os.path.dirname(self.journal_file_name) or '.'
+        if not os.path.isdir(directory):
+            return []
+        root, extension = os.path.splitext(os.path.basename(self.journal_file_name))
+        segments = []
+        for file_name in os.listdir(directory):
+            number = file_name[len(root) + 1:-len(extension)]
+            if file_name.startswith(root + '.') and file_name.endswith(extension) and number.isdigit():
+                segments.append(int(number))
+        return sorted(segments)
+
+    def replay_journals(self, first_segment, repair=True):
+        """ Replay the journal segments from first_segment on, oldest first, then the journal.
+            Returns the number of records replayed.
+        """
+        replayed = 0
+        for segment in self.journal_segments():
+            if segment >= first_segment:
+                # Segments were closed whole, so only the journal can end in a torn line
+                replayed += self.replay_journal(self.journal_segment_name(segment), repair=False)
+        return replayed + self.replay_journal(repair=repair)
+
+    def replay_journal(self, journal_file_name=None, repair=True):
+        """ Apply every record in the journal file (or in another journal segment) to the store.
+            Each record holds the full, current state of one employee or one shift, so replaying
+            a record simply replaces the matching entry (or adds it if it is new).
+            If the journal ends in a partly written line, the journal is cut back to the last
+            whole record (unless repair is False), so punches appended after it can be read back.
+            Returns the number of records replayed.
+        """
+        if journal_file_name == None:
+            journal_file_name = self.journal_file_name
+        if not os.path.exists(journal_file_name):
+            return 0
+
+        replayed = 0
+        # Bytes of whole records read so far
+        good_size = 0
+        damaged = False
+        ends_with_newline = True
+
+        with open(journal_file_name, "rb") as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash can leave a partly written last line; everything before it is good
+                    damaged = True
+                    break
+                good_size += len(line)
+                ends_with_newline = line.endswith(b'\n')
+                if 'employee' in record:
+                    self.store.add_employee(Employee.from_dict(record['employee']))
+                if 'shift' in record:
+                    self.store.add_shift(Shift.from_dict(record['shift']))
+                if 'totals' in record:
+                    emp_id, day, worked_seconds, break_seconds, lunch_seconds = record['totals']
+                    self.store.set_day_totals(emp_id, day, [worked_seconds, break_seconds, lunch_seconds])
+                replayed += 1
+
+        if repair and (damaged or not ends_with_newline):
+            if damaged:
+                print('\nWARNING: the last record in', journal_file_name, 'was only partly written and has been removed.')
+            with open(journal_file_name, "r+b") as journal:
+                journal.truncate(good_size)
+                # Start the next record on a line of its own
+                if not ends_with_newline:
+                    journal.seek(good_size)
+                    journal.write(b'\n')
+                journal.flush()
+                os.fsync(journal.fileno())
+
+        return replayed
+
+    def archive_file_name(self, month):
+        return os.path.join(self.archive_dir_name, month + '.bin')
+
+    def archive_months(self):
+        """ Return the months that have an archive file, oldest first. """
+        if not os.path.isdir(self.archive_dir_name):
+            return []
+        return sorted(file_name[:-len('.bin')] for file_name in os.listdir(self.archive_dir_name)
+            if file_name.endswith('.bin'))
+
+    def read_archive(self, month, emp_id=None):
+        """ Read the shifts archived for a month. If an employee id is given, only that
+            employee's records are read from the file.
+        """
+        file_name = self.archive_file_name(month)
+        if not os.path.exists(file_name):
+            return
+        with open(file_name, "rb") as archive_file:
+            employee_table, records_size, extras_size = self.read_archive_header(archive_file)
+            records_start = archive_file.tell()
+
+            if emp_id == None:
+                records = archive_file.read(records_size)
+                for archive_emp_id, record_offset, record_count in employee_table:
+                    yield from unpack_shifts(archive_emp_id, records[record_offset:], record_count)
+            else:
+                for i, (archive_emp_id, record_offset, record_count) in enumerate(employee_table):
+                    if archive_emp_id == emp_id:
+                        # Records are stored by employee, so this employee's records end where
+                        # the next employee's begin
+                        records_end = employee_table[i + 1][1] if i + 1 < len(employee_table) else records_size
+                        archive_file.seek(records_start + record_offset)
+                        records = archive_file.read(records_end - record_offset)
+                        yield from unpack_shifts(emp_id, records, record_count)
+
+            if extras_size > 0:
+                archive_file.seek(records_start + records_size)
+                for shift_data in json.loads(archive_file.read(extras_size)):
+                    if emp_id == None or shift_data['emp_id'] == emp_id:
+                        yield Shift.from_dict(shift_data)
+
+    def read_archive_header(self, archive_file):
+        """ Read an archive file's header and employee table, leaving the file at the first record.
+            Returns the employee table (id, record offset, record count for each employee), and the
+            sizes of the records and extras sections.
+        """
+        magic, employee_count, records_size, extras_size = ARCHIVE_HEADER.unpack(archive_file.read(ARCHIVE_HEADER.size))
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError(archive_file.name + ' is not a time clock archive file')
+
+        employee_table = []
+        for i in range(employee_count):
+            id_length = struct.unpack('<H', archive_file.read(2))[0]
+            archive_emp_id = archive_file.read(id_length).decode()
+            record_offset, record_count = ARCHIVE_EMPLOYEE.unpack(archive_file.read(ARCHIVE_EMPLOYEE.size))
+            employee_table.append((archive_emp_id, record_offset, record_count))
+        return employee_table, records_size, extras_size
+
+    def collect_shifts(self, columns, first_day, last_day):
+        """ Add every shift worked between two days (day numbers, inclusive) to a ShiftColumns.
+            Archived records are copied straight into the columns, without making Shift objects.
+        """
+        with self.lock:
+            # Shifts in the store that are new or changed replace their archived copies
+            replaced = set()
+            for shift in self.store.all_shifts():
+                if (shift.emp_id, shift.date) not in self.archived_shifts:
+                    day = shift.day
+                    if first_day <= day <= last_day:
+                        columns.add_shift(shift, day)
+                        replaced.add((shift.emp_id, day))
+
+            first_month = datetime.date.fromordinal(first_day).strftime("%Y-%m")
+            last_month = datetime.date.fromordinal(last_day).strftime("%Y-%m")
+            for month in self.archive_months():
+                if month < first_month or month > last_month:
+                    continue
+                with open(self.archive_file_name(month), "rb") as archive_file:
+                    employee_table, records_size, extras_size = self.read_archive_header(archive_file)
+                    records = archive_file.read(records_size)
+                    for emp_id, record_offset, record_count in employee_table:
+                        columns.add_records(emp_id, records, record_offset, record_count, first_day, last_day, replaced)
+                    if extras_size > 0:
+                        for shift_data in json.loads(archive_file.read(extras_size)):
+                            shift = Shift.from_dict(shift_data)
+                            day = shift.day
+                            if first_day <= day <= last_day and (shift.emp_id, day) not in replaced:
+                                columns.add_shift(shift, day)
+
+    def load_month(self, month):
+        """ Add a month's archived shifts to the store, unless they are already there. """
+        with self.lock:
+            if month in self.loaded_months:
+                return
+            with metrics.timer('load_month'):
+                for shift in self.read_archive(month):
+                    key = (shift.emp_id, shift.date)
+                    # A shift already in the store has changes newer than its archived copy
+                    if key not in self.store.shifts_by_emp_date:
+                        self.store.add_shift(shift)
+                        self.archived_shifts.add(key)
+            self.loaded_months.add(month)
+
+    def write_archive(self, month, content):
+        """ Replace a month's archive file with this content, made by pack_archive(). """
+        os.makedirs(self.archive_dir_name, exist_ok=True)
+        temp_file_name = self.archive_file_name(month) + ".tmp"
+        with open(temp_file_name, "wb") as archive_file:
+            archive_file.write(content)
+            archive_file.flush()
+            os.fsync(archive_file.fileno())
+            metrics.count('bytes_written', 'file', 'archive', archive_file.tell())
+        os.replace(temp_file_name, self.archive_file_name(month))
+        fsync_directory(self.archive_dir_name)
+
+    def write_snapshot(self):
+        """ Roll the journal over, and write a snapshot holding everything in it. """
+        self.build_snapshot(self.roll_journal())
+
+    def roll_journal(self):
+        """ Close the journal and rename it as the next numbered segment, so appends go to a new
+            journal file. Returns the number of the first segment a snapshot written after this
+            won't hold.
+        """
+        with self.journal_lock:
+            self.close_journal()
+            if self.journal_segment == None:
+                self.journal_segment = max([0] + self.journal_segments()) + 1
+            if os.path.exists(self.journal_file_name):
+                os.replace(self.journal_file_name, self.journal_segment_name(self.journal_segment))
+            else:
+                # Every snapshot gets a segment, even an empty one, so a missing segment shows up as a gap
+                open(self.journal_segment_name(self.journal_segment), "w").close()
+            fsync_directory(os.path.dirname(self.journal_file_name))
+            self.journal_segment += 1
+            self.journal_records = 0
+            return self.journal_segment
+
+    @metrics.timed('snapshot')
+    def build_snapshot(self, journal_segment):
+        """ Write every employee and open or recent shift to the data file, archive any other
+            shift that changed since it was last archived, then remove the journal segments
+            that this snapshot (which holds the segments before journal_segment) and every
+            backup snapshot hold.
+            The store is only locked while the snapshot and archives are put together; they are
+            written out after, so punches can carry on meanwhile.
+            Files are written to a temporary file first and renamed into place, so a crash part
+            way through never leaves a truncated data file behind.
+        """
+        with self.snapshot_lock:
+            # A newer snapshot has been written since the journal was rolled over
+            if journal_segment < self.snapshot_segment:
+                return
+
+            with self.lock:
+                # Only the months holding new or changed completed shifts need their archive rewritten
+                hot_shifts = []
+                changed_months = set()
+                for shift in self.store.all_shifts():
+                    if is_recent_or_open(shift):
+                        hot_shifts.append(shift)
+                    elif (shift.emp_id, shift.date) not in self.archived_shifts:
+                        changed_months.add(day_month(shift.day))
+
+                for month in changed_months:
+                    self.load_month(month)
+                shifts_by_month = {}
+                for shift in self.store.all_shifts():
+                    month = day_month(shift.day)
+                    if month in changed_months and not is_recent_or_open(shift):
+                        shifts_by_month.setdefault(month, []).append(shift)
+                # Shifts are marked archived as they are packed, so one changed after this is archived again next time
+                archives = {}
+                for month in sorted(shifts_by_month):
+                    archives[month] = pack_archive(shifts_by_month[month])
+                    for shift in shifts_by_month[month]:
+                        self.archived_shifts.add((shift.emp_id, shift.date))
+
+                # The snapshot being replaced becomes the first backup
+                backup_segments = ([self.snapshot_segment] + self.backup_segments)[:self.SNAPSHOTS_KEPT]
+                data_to_export = {'employees': [employee.to_dict() for employee in self.store.all_employees()],
+                    'shifts': [shift.to_dict() for shift in hot_shifts],
+                    'totals': self.store.all_day_totals(),
+                    'journal_segment': journal_segment,
+                    'backup_journal_segments': backup_segments}
+
+            for month in sorted(archives):
+                self.write_archive(month, archives[month])
+            temp_file_name = self.data_file_name + ".tmp"
+            with open(temp_file_name, "wb") as data_file:
+                data_file.write(snapshot_with_checksum(json.dumps(data_to_export, indent=4).encode()))
+                data_file.flush()
+                os.fsync(data_file.fileno())
+                metrics.count('bytes_written', 'file', 'snapshot', data_file.tell())
+
+            # Keep the last few snapshots, in case the newest one is ever damaged
+            for i in range(self.SNAPSHOTS_KEPT - 1, 0, -1):
+                if os.path.exists(self.data_file_name + '.' + str(i)):
+                    os.replace(self.data_file_name + '.' + str(i), self.data_file_name + '.' + str(i + 1))
+            if os.path.exists(self.data_file_name):
+                os.replace(self.data_file_name, self.data_file_name + '.1')
+            os.replace(temp_file_name, self.data_file_name)
+            fsync_directory(os.path.dirname(self.data_file_name))
+            self.snapshot_segment = journal_segment
+            self.backup_segments = backup_segments
+
+            # Segments held by this snapshot and every backup can go
+            for segment in self.journal_segments():
+                if segment < min([journal_segment] + backup_segments):
+                    os.remove(self.journal_segment_name(segment))
+            fsync_directory(os.path.dirname(self.journal_file_name))
+
+    def journal_line(self, employee=None, shift=None):
+        """ Make a journal record of the changed employee and/or shift, and the shift's day totals. """
+        record = {}
+        if employee != None:
+            record['employee'] = employee.to_dict()
+        if shift != None:
+            record['shift'] = shift.to_dict()
+            day = shift.day
+            # One shift per employee per day, so the day's totals are the shift's
+            record['totals'] = [shift.emp_id, day] + shift_totals(shift)
+        return json.dumps(record, separators=(',', ':')) + '\n'
+
+    def save(self, employee=None, shift=None):
+        """ Append a record of the changed employee and/or shift to the journal file. Returns
+            once the record is on disk.
+        """
+        self.write_journal([self.journal_line(employee, shift)], [shift] if shift != None else [])
+
+    def save_batch(self, employees, shifts):
+        """ Append records of many changed employees and shifts to the journal file at once,
+            forcing them to disk together.
+        """
+        lines = [self.journal_line(employee=employee) for employee in employees]
+        lines.extend(self.journal_line(shift=shift) for shift in shifts)
+        self.write_journal(lines, shifts)
+
+    def write_journal(self, lines, shifts):
+        """ Hand journal lines for changes to these shifts to the writer thread, and wait until
+            they are on disk.
+        """
+        with self.lock:
+            for shift in shifts:
+                self.archived_shifts.discard((shift.emp_id, shift.date))
+            if self.writer == None:
+                self.writer = GroupCommitWriter(self.append_journal, 'journal-writer')
+            writer = self.writer
+        writer.commit(lines)
+
+    def append_journal(self, lines):
+        """ Append a group of journal lines and force them to disk with one fsync. Called by the
+            writer thread.
+        """
+        with self.journal_lock:
+            if self.journal_file == None:
+                self.journal_file = open(self.journal_file_name, "a")
+            journal_text = ''.join(lines)
+            self.journal_file.write(journal_text)
+            self.journal_file.flush()
+            metrics.count('bytes_written', 'file', 'journal', len(journal_text))
+            with metrics.timer('fsync_journal'):
+                os.fsync(self.journal_file.fileno())
+            self.journal_records += len(lines)
+
+            # Roll the journal into a new snapshot once it gets long, to keep startup replay short.
+            # The snapshot is written from another thread, so the punches in this group (and the
+            # ones after it) don't wait for it
+            if self.journal_records >= self.COMPACT_EVERY and (self.compactor == None or not self.compactor.is_alive()):
+                self.compactor = threading.Thread(target=self.compact, args=(self.roll_journal(),),
+                    name='journal-compactor', daemon=True)
+                self.compactor.start()
+
+    def compact(self, journal_segment):
+        """ Write a snapshot holding the journal segments before this one. Run by the compactor thread. """
+        try:
+            self.build_snapshot(journal_segment)
+        except OSError as error:
+            # The segments are kept until a snapshot holds them, so nothing is lost
+            print('\nWARNING: Could not write', self.data_file_name, '-', error.strerror, '\n')
+
+    def load_shift(self, emp_id, date):
+        """ Read the archive for the shift's month into the store, and return the shift if found. """
+        self.load_month(date_month(date))
+        return self.store.shifts_by_emp_date.get((emp_id, date))
+
+    def load_employee_shifts(self, emp_id):
+        """ Return an employee's archived shifts, reading only their records from each month. """
+        emp_shifts = []
+        for month in self.archive_months():
+            if month in self.loaded_months:
+                continue
+            for shift in self.read_archive(month, emp_id):
+                emp_shifts.append(shift)
+                self.archived_shifts.add((shift.emp_id, shift.date))
+        return emp_shifts
 
-def update_data_file():
-    """ When a change is made to employee or shift status, write a new data file"""
+    def load_employee_shifts_between(self, emp_id, first_day, last_day):
+        """ Return an employee's archived shifts between two days (day numbers, inclusive),
+            reading only their records from the months holding those days.
+        """
+        first_month = day_month(max(first_day, 1))
+        last_month = day_month(last_day)
+        emp_shifts = []
+        for month in self.archive_months():
+            if month in self.loaded_months or not (first_day <= 0 or first_month <= month <= last_month):
+                continue
+            for shift in self.read_archive(month, emp_id):
+                if first_day <= shift.day <= last_day:
+                    emp_shifts.append(shift)
+                    self.archived_shifts.add((shift.emp_id, shift.date))
+        return emp_shifts
 
-    data_to_export = {'employees': employees, 'shifts': shifts}
+    def load_shifts_between(self, first_day, last_day):
+        """ Read the archives for the months holding these days (day numbers, inclusive) into the
+            store. Returns no shifts, since load_month() has already added them.
+        """
+        first_month = day_month(max(first_day, 1))
+        last_month = day_month(last_day)
+        for month in self.archive_months():
+            if first_day <= 0 or first_month <= month <= last_month:
+                self.load_month(month)
+        return []
 
-    # Write updated data to data file
-    with open("time_clock_data.json", "w") as data_file:
-        json.dump(data_to_export, data_file, indent=4)
+    def all_shifts(self):
+        """ Return every shift, reading the whole archive into the store. """
+        for month in self.archive_months():
+            self.load_month(month)
+        return self.store.all_shifts()
+
+    def close_journal(self):
+        with self.journal_lock:
+            if self.journal_file != None:
+                self.journal_file.flush()
+                os.fsync(self.journal_file.fileno())
+                self.journal_file.close()
+                self.journal_file = None
+
+    def close(self):
+        """ Wait for the writer thread to finish writing any punches handed to it, and close the
+            journal file.
+        """
+        with self.lock:
+            writer = self.writer
+            self.writer = None
+        if writer != None:
+            writer.stop()
+        # Let a snapshot being written finish, rather than leave it half written at exit
+        compactor = self.compactor
+        if compactor != None:
+            compactor.join()
+        self.close_journal()
+
+class SqliteStorage:
+    """ Keeps data in a SQLite database, one row per employee and one row per shift.
+        Breaks and lunches are stored as json text in their shift's row, so every punch is a
+        single-row INSERT or UPDATE. Only employees and open or recent shifts are loaded at
+        startup; older shifts are read from the database when they are asked for.
+    """
+    CREATE_TABLES = """
+        CREATE TABLE IF NOT EXISTS employees (
+            id TEXT PRIMARY KEY,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            is_admin INTEGER NOT NULL DEFAULT 0,
+            shift_active INTEGER NOT NULL DEFAULT 0,
+            at_lunch INTEGER NOT NULL DEFAULT 0,
+            on_break INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS shifts (
+            emp_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            shift_start TEXT,
+            shift_end TEXT,
+            breaks TEXT NOT NULL DEFAULT '[]',
+            lunches TEXT NOT NULL DEFAULT '[]',
+            PRIMARY KEY (emp_id, date)
+        );
+        CREATE INDEX IF NOT EXISTS shifts_by_emp_day ON shifts (emp_id, day);
+        CREATE INDEX IF NOT EXISTS shifts_by_day ON shifts (day);
+        CREATE INDEX IF NOT EXISTS open_shifts ON shifts (emp_id) WHERE shift_end IS NULL;
+        CREATE TABLE IF NOT EXISTS day_totals (
+            emp_id TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            worked_seconds INTEGER NOT NULL,
+            break_seconds INTEGER NOT NULL,
+            lunch_seconds INTEGER NOT NULL,
+            PRIMARY KEY (emp_id, day)
+        );
+        CREATE INDEX IF NOT EXISTS day_totals_by_day ON day_totals (day);
+    """
+    UPSERT_EMPLOYEE = """
+        INSERT INTO employees (id, first_name, last_name, is_admin, shift_active, at_lunch, on_break)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET
+            first_name = excluded.first_name, last_name = excluded.last_name,
+            is_admin = excluded.is_admin, shift_active = excluded.shift_active,
+            at_lunch = excluded.at_lunch, on_break = excluded.on_break
+    """
+    UPSERT_SHIFT = """
+        INSERT INTO shifts (emp_id, date, day, shift_start, shift_end, breaks, lunches)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (emp_id, date) DO UPDATE SET
+            shift_start = excluded.shift_start, shift_end = excluded.shift_end,
+            breaks = excluded.breaks, lunches = excluded.lunches
+    """
+    UPSERT_DAY_TOTALS = """
+        INSERT INTO day_totals (emp_id, day, worked_seconds, break_seconds, lunch_seconds)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (emp_id, day) DO UPDATE SET
+            worked_seconds = excluded.worked_seconds, break_seconds = excluded.break_seconds,
+            lunch_seconds = excluded.lunch_seconds
+    """
+    SELECT_SHIFT_COLUMNS = "SELECT emp_id, date, shift_start, shift_end, breaks, lunches FROM shifts"
+    # Bumped in the database's user_version once day_totals has been filled in
+    TOTALS_VERSION = 1
+
+    def __init__(self, database_file_name="time_clock_data.db", directory=''):
+        self.database_file_name = os.path.join(directory, database_file_name)
+        self.connection = None
+        # Background thread committing changes (started by the first save)
+        self.writer = None
+        # (first day, last day) ranges whose shifts have been read into the store
+        self.loaded_day_ranges = []
+        self.store = None
+        # The connection is shared by every thread in server mode, one statement at a time
+        self.lock = threading.RLock()
+
+    def connect(self):
+        if self.connection == None:
+            self.connection = sqlite3.connect(self.database_file_name, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            # Every commit is forced to disk; the writer thread groups punches so they share commits
+            self.connection.execute("PRAGMA synchronous=FULL")
+            self.connection.executescript(self.CREATE_TABLES)
+        return self.connection
+
+    def load(self, store):
+        """ Load every employee, their running totals, and open and recent shifts into the store.
+            If the database has no employees (first program run), populate it with mock data.
+        """
+        self.store = store
+        connection = self.connect()
+        if connection.execute("SELECT COUNT(*) FROM employees").fetchone()[0] == 0:
+            mock_employees, mock_shifts = create_mock_data()
+            self.save_all(mock_employees, mock_shifts)
+
+        for row in connection.execute("SELECT id, first_name, last_name, is_admin, shift_active, at_lunch, on_break FROM employees"):
+            store.add_employee(self.employee_from_row(row))
+
+        recent_day = datetime.date.today().toordinal() - RECENT_DAYS
+        for row in connection.execute(self.SELECT_SHIFT_COLUMNS + " WHERE shift_end IS NULL OR day >= ?", (recent_day,)):
+            store.add_shift(self.shift_from_row(row))
+
+        # Databases from older versions have no running totals, so work them out once
+        if connection.execute("PRAGMA user_version").fetchone()[0] < self.TOTALS_VERSION:
+            # One shift per employee per day, so each day's totals are its shift's
+            shifts = [self.shift_from_row(row) for row in connection.execute(self.SELECT_SHIFT_COLUMNS)]
+            with connection:
+                connection.executemany(self.UPSERT_DAY_TOTALS, ([shift.emp_id, shift.day] + shift_totals(shift)
+                    for shift in shifts if shift.shift_end != None))
+                connection.execute("PRAGMA user_version = " + str(self.TOTALS_VERSION))
+
+        # Only the current week and pay period's totals are loaded; older ones are worked out when asked for
+        for row in connection.execute("SELECT emp_id, day, worked_seconds, break_seconds, lunch_seconds FROM day_totals WHERE day >= ?",
+                (store.totals_first_day,)):
+            store.set_day_totals(row[0], row[1], [row[2], row[3], row[4]])
+
+    def employee_row(self, employee):
+        return (employee.id, employee.first_name, employee.last_name, employee.is_admin,
+            employee.shift_active, employee.at_lunch, employee.on_break)
+
+    def employee_from_row(self, row):
+        return Employee.from_dict({'id': row[0], 'first_name': row[1], 'last_name': row[2], 'is_admin': bool(row[3]),
+            'shift_active': bool(row[4]), 'at_lunch': bool(row[5]), 'on_break': bool(row[6])})
+
+    def shift_row(self, shift):
+        return (shift.emp_id, shift.date, shift.day, format_time(shift.shift_start), format_time(shift.shift_end),
+            json.dumps([brk.to_dict() for brk in shift.breaks]), json.dumps([lunch.to_dict() for lunch in shift.lunches]))
+
+    def shift_from_row(self, row):
+        return Shift.from_dict({'emp_id': row[0], 'date': row[1], 'shift_start': row[2], 'shift_end': row[3],
+            'breaks': json.loads(row[4]), 'lunches': json.loads(row[5])})
+
+    def save(self, employee=None, shift=None):
+        """ Write the changed employee and/or shift rows, and the shift's day totals. Returns once
+            they are committed.
+        """
+        self.save_batch([employee] if employee != None else [], [shift] if shift != None else [])
+
+    def save_batch(self, employees, shifts):
+        """ Write many changed employees and shifts, and the shifts' day totals, in one transaction. """
+        # Rows are made now, while the caller still holds the employee's lock
+        statements = [(self.UPSERT_EMPLOYEE, self.employee_row(employee)) for employee in employees]
+        for shift in shifts:
+            statements.append((self.UPSERT_SHIFT, self.shift_row(shift)))
+            # One shift per employee per day, so the day's totals are the shift's
+            statements.append((self.UPSERT_DAY_TOTALS, [shift.emp_id, shift.day] + shift_totals(shift)))
+        with self.lock:
+            if self.writer == None:
+                self.writer = GroupCommitWriter(self.execute_statements, 'database-writer')
+            writer = self.writer
+        writer.commit(statements)
+
+    def execute_statements(self, statements):
+        """ Run a group of statements in one transaction. Called by the writer thread. """
+        with self.lock:
+            connection = self.connect()
+            with connection:
+                for sql, parameters in statements:
+                    connection.execute(sql, parameters)
+
+    def save_all(self, employees, shifts):
+        """ Write many employees and shifts in one transaction. """
+        with self.lock:
+            connection = self.connect()
+            with connection:
+                connection.executemany(self.UPSERT_EMPLOYEE, (self.employee_row(employee) for employee in employees))
+                connection.executemany(self.UPSERT_SHIFT, (self.shift_row(shift) for shift in shifts))
+
+    def load_shift(self, emp_id, date):
+        with self.lock:
+            row = self.connect().execute(self.SELECT_SHIFT_COLUMNS + " WHERE emp_id = ? AND date = ?", (emp_id, date)).fetchone()
+        if row != None:
+            return self.shift_from_row(row)
+
+    def load_employee_shifts(self, emp_id):
+        with self.lock:
+            rows = self.connect().execute(self.SELECT_SHIFT_COLUMNS + " WHERE emp_id = ? ORDER BY day", (emp_id,)).fetchall()
+        return [self.shift_from_row(row) for row in rows]
+
+    def load_employee_shifts_between(self, emp_id, first_day, last_day):
+        """ Return an employee's shifts between two days (day numbers, inclusive). """
+        with self.lock:
+            rows = self.connect().execute(self.SELECT_SHIFT_COLUMNS + " WHERE emp_id = ? AND day BETWEEN ? AND ? ORDER BY day",
+                (emp_id, first_day, last_day)).fetchall()
+        return [self.shift_from_row(row) for row in rows]
+
+    def load_shifts_between(self, first_day, last_day):
+        """ Return the shifts worked between two days (day numbers, inclusive), unless they have
+            been loaded before.
+        """
+        with self.lock:
+            for loaded_first_day, loaded_last_day in self.loaded_day_ranges:
+                if loaded_first_day <= first_day and last_day <= loaded_last_day:
+                    return []
+            rows = self.connect().execute(self.SELECT_SHIFT_COLUMNS + " WHERE day BETWEEN ? AND ?",
+                (first_day, last_day)).fetchall()
+            self.loaded_day_ranges.append((first_day, last_day))
+        return [self.shift_from_row(row) for row in rows]
+
+    def collect_shifts(self, columns, first_day, last_day):
+        """ Add every shift worked between two days (day numbers, inclusive) to a ShiftColumns. """
+        with self.lock:
+            rows = self.connect().execute("SELECT emp_id, date, shift_start, shift_end, breaks, lunches, day FROM shifts"
+                " WHERE day BETWEEN ? AND ?", (first_day, last_day)).fetchall()
+        for row in rows:
+            columns.add_shift(self.shift_from_row(row), row[6])
+
+    def close(self):
+        """ Wait for the writer thread to commit anything handed to it, and close the database. """
+        with self.lock:
+            writer = self.writer
+            self.writer = None
+        if writer != None:
+            writer.stop()
+        with self.lock:
+            if self.connection != None:
+                self.connection.close()
+                self.connection = None
+
+@metrics.timed('load')
+def get_employee_data(storage_type="json", directory=''):
+    """ Set up the storage for employee and shift data, and load the data into the store.
+        Data is kept in the current directory, or in a site's directory (see site_directory()).
+    """
+    global storage
+
+    if directory != '':
+        os.makedirs(directory, exist_ok=True)
+    if storage_type == "sqlite":
+        storage = SqliteStorage(directory=directory)
+    else:
+        storage = JsonStorage(directory=directory)
+    try:
+        storage.load(store)
+    except ValueError as error:
+        print('\nERROR:', error, '\n')
+        sys.exit(1)
+    store.storage = storage
+    store.rebuild_active_state()
+
+# Changes held back by batched_writes(), keyed by employee id and by (employee id, date)
+pending_employees = None
+pending_shifts = None
+
+@metrics.timed('save')
+def update_data_file(employee=None, shift=None):
+    """ When a change is made to employee or shift status, save the changed employee and/or shift.
+        Only the changed records are written, so the cost of a punch does not depend on how much
+        history is stored.
+    """
+    if pending_employees != None:
+        if employee != None:
+            pending_employees[employee.id] = employee
+        if shift != None:
+            pending_shifts[(shift.emp_id, shift.date)] = shift
+        return
+    storage.save(employee, shift)
+
+@contextlib.contextmanager
+def batched_writes():
+    """ Hold back the changes made inside a with block, and save them all in one write at the
+        end. An employee or shift changed many times in the block is only written once.
+    """
+    global pending_employees, pending_shifts
+
+    pending_employees = {}
+    pending_shifts = {}
+    try:
+        yield
+    finally:
+        employees = list(pending_employees.values())
+        shifts = list(pending_shifts.values())
+        pending_employees = None
+        pending_shifts = None
+        if len(employees) > 0 or len(shifts) > 0:
+            with metrics.timer('save_batch'):
+                storage.save_batch(employees, shifts)
+
+def close_data_file():
+    if storage != None:
+        storage.close()
+
+def migrate_json_to_sqlite(directory=''):
+    """ Import the employees and shifts in time_clock_data.json (and its journal) into the
+        SQLite database.
+    """
+    json_store = TimeClockStore()
+    json_storage = JsonStorage(directory=directory)
+    json_storage.load(json_store)
+    json_storage.close()
+
+    sqlite_storage = SqliteStorage(directory=directory)
+    sqlite_storage.save_all(json_store.all_employees(), json_storage.all_shifts())
+    sqlite_storage.close()
+    print('\nImported', len(json_store.employees_by_id), 'employees and', len(json_store.shifts_by_emp_date),
+        'shifts into', sqlite_storage.database_file_name, '\n')
 
 def show_start_menu():
-    """ Prompts user to sign in, register as new user, or quit the program. """
+    """ Prompts user to sign in, register as new user, or quit the program.
+        Returns the next menu to show.
+    """
     
     print('Please choose from the following options:\n')
     print('PRESS 1 to sign in\nPRESS 2 to register as a new user\nPRESS 0 to quit the Time Clock program\n')
-    option = input()
+    option = menu_input()
 
-    if option == '1':    
-        emp_id = input('\nPlease enter Employee ID: ')
-        if validate_emp_id(emp_id) == False:
-            show_start_menu()
-        else:
-            global current_employee
-            current_employee = [employee for employee in employees if emp_id == employee['id']][0]
-            print('\nWelcome back,', current_employee['first_name'])
-            show_main_menu()
-
-    elif option == '2':
-        current_employee = register()
-        if current_employee == None:
-            print('\nERROR: Some of your input was blank. Try again.\n')
-            show_start_menu()
-        else:
-            print('\nWelcome to the team,', current_employee['first_name'], current_employee['last_name'] + '!\n')
-            show_main_menu()
+    if option in START_MENU_OPTIONS:
+        return START_MENU_OPTIONS[option]()
+    print('\n*** INVALID ENTRY ***\n')
+    return 'start'
 
-    elif option == '0':
-        print('\nExiting the Time Clock program. Goodbye!\n')
-        quit()
-    else:
-        print('\n*** INVALID ENTRY ***\n')
-        show_start_menu()
+def sign_in():
+    global current_employee
+    emp_id = menu_input('\nPlease enter Employee ID: ')
+    employee = validate_emp_id(emp_id)
+    if employee == None:
+        return 'start'
+    current_employee = employee
+    print('\nWelcome back,', current_employee.first_name)
+    return 'main'
+
+def register_new_user():
+    global current_employee
+    new_user = register()
+    if new_user == None:
+        print('\nERROR: Registration was not completed. Try again.\n')
+        return 'start'
+    current_employee = new_user
+    print('\nWelcome to the team,', current_employee.first_name, current_employee.last_name + '!\n')
+    return 'main'
+
+def quit_program():
+    print('\nExiting the Time Clock program. Goodbye!\n')
+    return 'quit'
+
+START_MENU_OPTIONS = {
+    '1': sign_in,
+    '2': register_new_user,
+    '0': quit_program,
+}
 
 def validate_emp_id(emp_id):
-    """ Check user input against the employees list for valid employee id.
-        If valid employee id, return True.
-        If invalid employee id, display error message and return False.
+    """ Check user input against the store for valid employee id.
+        If valid employee id, return the employee, so it doesn't have to be looked up again.
+        If invalid employee id, display error message and return None.
     """
 
-    if emp_id != '':
-        global current_employee
-        current_employee_list = [employee for employee in employees if employee['id'] == emp_id]
-        if len(current_employee_list) < 1:
-            print('\n*** Employee ID not valid. ***\n')
-            return False
-        else:
-            return True
-    else:
+    employee = store.get_employee(emp_id) if emp_id != '' else None
+    if employee == None:
         print('\n*** Employee ID not valid. ***\n')
-        return False
+    return employee
 
 def show_main_menu():
-    """ Display options for various clock punches based on current shift, break, and lunch status. """
-    
+    """ Display options for various clock punches based on current shift, break, and lunch status.
+        Returns the next menu to show.
+    """
+
+    # Show hours from completed shifts, straight from the running totals
+    today = datetime.date.today().toordinal()
+    week_hours = store.get_totals(current_employee.id, 'week', today)[0] / 3600
+    period_hours = store.get_totals(current_employee.id, 'period', today)[0] / 3600
+    print('Hours worked this week:', format(week_hours, '.2f'), '  This pay period:', format(period_hours, '.2f'))
+    if week_hours >= OVERTIME_HOURS_PER_WEEK:
+        print('*** You have reached overtime for this week. ***')
+
     print('Please select an option:\n')
-    if current_employee['shift_active'] == False:
+    if current_employee.shift_active == False:
         # If there is already a shift for this day, prompt them to sign out
-        this_day_shifts = [shift for shift in shifts if shift['emp_id'] == current_employee['id'] and
-            shift['date'] == datetime.datetime.now().strftime("%x")]
-        if len(this_day_shifts) > 0:
+        if store.get_shift(current_employee.id, datetime.datetime.now().strftime("%x")) != None:
             print('\nYou have completed your shift for the day. Thank you!\n')
         else:
             print('\nPRESS 1 to start a shift')
-    elif current_employee['on_break'] == True:
+    elif current_employee.on_break == True:
         print('PRESS 2 to end your break')
-    elif current_employee['at_lunch'] == True:
+    elif current_employee.at_lunch == True:
         print('PRESS 3 to end your lunch')
     else:
         print('PRESS 4 to start your break')
         print('PRESS 5 to start your lunch')
         print('PRESS 6 to end your shift')
 
-    if current_employee['is_admin'] == True:
+    if current_employee.is_admin == True:
         print('PRESS 8 for the Administrator menu')
     print('PRESS 9 to sign out\n')
 
-    option = input()
-    process_main_menu_input(option)
+    option = menu_input()
+    return process_main_menu_input(option)
 
 def show_admin_menu():
-    """ Display options to allow administrators to perform any function. """
+    """ Display options to allow administrators to perform any function.
+        Returns the next menu to show.
+    """
 
-    if current_employee['is_admin'] == False:
+    if current_employee.is_admin == False:
         print('Unauthorized to access this menu.')
-        show_main_menu()
-    else:
-        print('Please select an option:')
-        print('\nPRESS 1 adjust an employee time record')
-        print('PRESS 2 to display a shift report')
-        print('PRESS 3 to update employee profile')
-        print('PRESS 4 to go back to the main menu\n')
-
-    option = input()
-    process_admin_task(option)
-
-def start_shift(emp, date, time):
-    # Make sure there isn't already a shift for this date
-    all_emp_shifts = [shift for shift in shifts if shift['emp_id'] == emp['id'] and shift['date'] == date]
-    if len(all_emp_shifts) > 0:
-        print('\nThere is already a shift for this employee on this date.\n')
-    else:
-        new_shift = Shift(emp['id'], date, time).__dict__
-        shifts.append(new_shift)
-        emp['shift_active'] = True
-        update_data_file()
-        print ('\nSHIFT STARTED:', emp['first_name'], emp['last_name'], '--', new_shift['date'], new_shift['shift_start'],'\n')
-
-def end_shift(emp, date, time):
-    shift_to_end = [shift for shift in shifts if shift['date'] == date and shift['emp_id'] == emp['id']][0]
-    if shift_to_end['shift_end'] == None:
-        shift_to_end['shift_end'] = time
-        emp['shift_active'] = False
-        update_data_file()
-        print ('\nSHIFT ENDED:', emp['first_name'], emp['last_name'], '--', shift_to_end['date'], shift_to_end['shift_end'],'\n')
+        return 'main'
+
+    print('Please select an option:')
+    print('\nPRESS 1 adjust an employee time record')
+    print('PRESS 2 to display or save a shift report')
+    print('PRESS 3 to update employee profile')
+    print('PRESS 4 to go back to the main menu')
+    print('PRESS 5 to export payroll hours')
+    print('PRESS 6 to import punches from a file')
+    print('PRESS 7 to view performance metrics')
+    print('PRESS 8 to see who is clocked in')
+    print('PRESS 9 to find an employee by name\n')
+
+    option = menu_input()
+    return process_admin_task(option)
+
+# Menus by name. Each one returns the name of the next menu to show, or 'quit'.
+MENUS = {
+    'start': show_start_menu,
+    'main': show_main_menu,
+    'admin': show_admin_menu,
+}
+
+# Where menus read their input from; run_menus() swaps this out for scripted input
+menu_input = input
+
+def run_menus(inputs=None):
+    """ Show menus one after another until the user quits.
+        Each menu returns the next one to show rather than calling it, so a terminal left
+        running all day doesn't build up a deeper and deeper call stack.
+        If a list of inputs is given, it is used instead of the keyboard, and the menus stop
+        when it runs out (useful for scripted runs and benchmarks).
+    """
+    global menu_input
+
+    if inputs != None:
+        scripted_inputs = iter(inputs)
+        def menu_input(prompt=''):
+            print(prompt, end='')
+            return next(scripted_inputs)
+
+    menu = 'start'
+    try:
+        while menu != 'quit':
+            menu = MENUS[menu]()
+    except (EOFError, StopIteration):
+        # Keyboard input closed, or scripted input ran out
+        pass
+    finally:
+        menu_input = input
+
+def punch_refusal(emp, action, date):
+    """ Check a punch against the state of the employee's shift on that date (rather than their
+        current status, so punches for past days can be checked too).
+        Returns the reason the punch isn't allowed, or None if it is.
+    """
+    shift = store.get_shift(emp.id, date)
+    if action == 'start_shift':
+        if shift != None:
+            return 'There is already a shift for this employee on this date.'
+        return None
+    if shift == None:
+        return 'There is no shift for this employee on this date.'
+    if shift.shift_end != None:
+        return 'This shift was already ended on ' + shift.date + ' at ' + str(format_time(shift.shift_end)) + '.'
+    on_break = any(brk.break_end == None for brk in shift.breaks)
+    at_lunch = any(lunch.lunch_end == None for lunch in shift.lunches)
+    if action == 'end_shift' and (on_break or at_lunch):
+        return 'End the break or lunch before ending the shift.'
+    if action in ['start_break', 'start_lunch'] and (on_break or at_lunch):
+        return 'There is already a break or lunch going on in this shift.'
+    if action == 'end_break' and not on_break:
+        return 'There is no active break for this shift.'
+    if action == 'end_lunch' and not at_lunch:
+        return 'There is no active lunch for this shift.'
+    return None
+
+def is_live_shift(shift):
+    """ Return True if punches on this shift change the employee's current status: it is today's
+        shift, or the shift they are clocked into. Punches entered for other days (admin
+        corrections, imported backfill) only change that day's shift.
+    """
+    if shift.day == datetime.date.today().toordinal():
+        return True
+    entry = store.active.get(shift.emp_id)
+    return entry != None and entry['date'] == shift.date
+
+def refuse_punch(emp, action, date):
+    """ Print why a punch isn't allowed. Returns True if it was refused. """
+    reason = punch_refusal(emp, action, date)
+    if reason != None:
+        print('\n' + reason + '\n')
+    return reason != None
+
+def save_punch(emp, shift, live, shift_active=None, on_break=None, at_lunch=None):
+    """ Save a punched shift, and if it is a live shift, the employee's new status. """
+    if live:
+        if shift_active != None:
+            emp.shift_active = shift_active
+        if on_break != None:
+            emp.on_break = on_break
+        if at_lunch != None:
+            emp.at_lunch = at_lunch
+        update_data_file(emp, shift)
+        store.set_active_state(emp, shift)
     else:
-        print('\n This shift was already ended on', shift_to_end['date'], 'at', shift_to_end['shift_end'], '.\n')
-    
-def start_break(emp, date, time):
-    emp_shifts = [shift for shift in shifts if shift['emp_id'] == emp['id'] and shift['date'] == date]
-    if len(emp_shifts) > 0:
-        shift = emp_shifts[0]
-        new_break = Break(time).__dict__
-        shift['breaks'].append(new_break)
-        emp['on_break'] = True
-        update_data_file()
-        print ('\nBREAK STARTED:', emp['first_name'], emp['last_name'], '--', shift['date'], new_break['break_start'],'\n')
-
-def end_break(emp, date, time):
-    emp_shifts = [shift for shift in shifts if shift['emp_id'] == emp['id'] and shift['date'] == date]
-    if len(emp_shifts) > 0:
-        shift = emp_shifts[0]
-        for brk in shift['breaks']:
-            if brk['break_start'] != None and brk['break_end'] == None:
-                brk['break_end'] = time
-                emp['on_break'] = False
-                update_data_file()
-                print ('\nBREAK ENDED:', emp['first_name'], emp['last_name'], '--', shift['date'], brk['break_end'],'\n')
-            else:
-                print('\nThere is no active break for this shift.')
-
-def start_lunch(emp, date, time):
-    emp_shifts = [shift for shift in shifts if shift['emp_id'] == emp['id'] and shift['date'] == date]
-    if len(emp_shifts) > 0:
-        shift = emp_shifts[0]
-        new_lunch = Lunch(time).__dict__
-        shift['lunches'].append(new_lunch)
-        emp['at_lunch'] = True
-        update_data_file()
-        print ('\nLUNCH STARTED:', emp['first_name'], emp['last_name'], '--', shift['date'], new_lunch['lunch_start'],'\n')
-
-def end_lunch(emp, date, time):
-    emp_shifts = [shift for shift in shifts if shift['emp_id'] == emp['id'] and shift['date'] == date]
-    if len(emp_shifts) > 0:
-        shift = emp_shifts[0]
-        for lunch in shift['lunches']:
-            if lunch['lunch_start'] != None and lunch['lunch_end'] == None:
-                lunch['lunch_end'] = time
-                emp['at_lunch'] = False
-                update_data_file()
-                print ('\nLUNCH ENDED:', emp['first_name'], emp['last_name'], '--', shift['date'], lunch['lunch_end'],'\n')
-            else:
-                print('\nThere is no active lunch for this shift.')
+        update_data_file(shift=shift)
+
+@metrics.timed('start_shift')
+def start_shift(emp, date, time, announce=True):
+    """ Start a shift for the employee. Returns True if the punch was recorded. """
+    time = time_value(date, time)
+    if refuse_punch(emp, 'start_shift', date):
+        return False
+    new_shift = Shift(emp.id, date, time)
+    store.add_shift(new_shift)
+    save_punch(emp, new_shift, is_live_shift(new_shift), shift_active=True)
+    if announce:
+        print ('\nSHIFT STARTED:', emp.first_name, emp.last_name, '--', new_shift.date, format_time(new_shift.shift_start),'\n')
+    return True
+
+@metrics.timed('end_shift')
+def end_shift(emp, date, time, announce=True):
+    """ End the employee's shift on this date. Returns True if the punch was recorded. """
+    time = time_value(date, time)
+    if refuse_punch(emp, 'end_shift', date):
+        return False
+    shift_to_end = store.get_shift(emp.id, date)
+    # Checked before the shift ends, since an ended shift is no longer the one clocked into
+    live = is_live_shift(shift_to_end)
+    old_shift_totals = shift_totals(shift_to_end)
+    shift_to_end.shift_end = time
+    store.update_shift_totals(shift_to_end, old_shift_totals)
+    save_punch(emp, shift_to_end, live, shift_active=False)
+    if announce:
+        print ('\nSHIFT ENDED:', emp.first_name, emp.last_name, '--', shift_to_end.date, format_time(shift_to_end.shift_end),'\n')
+    return True
+
+@metrics.timed('start_break')
+def start_break(emp, date, time, announce=True):
+    """ Start a break in the employee's shift on this date. Returns True if the punch was recorded. """
+    time = time_value(date, time)
+    if refuse_punch(emp, 'start_break', date):
+        return False
+    shift = store.get_shift(emp.id, date)
+    new_break = Break(time)
+    shift.breaks.append(new_break)
+    save_punch(emp, shift, is_live_shift(shift), on_break=True)
+    if announce:
+        print ('\nBREAK STARTED:', emp.first_name, emp.last_name, '--', shift.date, format_time(new_break.break_start),'\n')
+    return True
+
+@metrics.timed('end_break')
+def end_break(emp, date, time, announce=True):
+    """ End the open break in the employee's shift on this date. Returns True if the punch was recorded. """
+    time = time_value(date, time)
+    if refuse_punch(emp, 'end_break', date):
+        return False
+    shift = store.get_shift(emp.id, date)
+    brk = next(brk for brk in shift.breaks if brk.break_end == None)
+    old_shift_totals = shift_totals(shift)
+    brk.break_end = time
+    store.update_shift_totals(shift, old_shift_totals)
+    save_punch(emp, shift, is_live_shift(shift), on_break=False)
+    if announce:
+        print ('\nBREAK ENDED:', emp.first_name, emp.last_name, '--', shift.date, format_time(brk.break_end),'\n')
+    return True
+
+@metrics.timed('start_lunch')
+def start_lunch(emp, date, time, announce=True):
+    """ Start a lunch in the employee's shift on this date. Returns True if the punch was recorded. """
+    time = time_value(date, time)
+    if refuse_punch(emp, 'start_lunch', date):
+        return False
+    shift = store.get_shift(emp.id, date)
+    new_lunch = Lunch(time)
+    shift.lunches.append(new_lunch)
+    save_punch(emp, shift, is_live_shift(shift), at_lunch=True)
+    if announce:
+        print ('\nLUNCH STARTED:', emp.first_name, emp.last_name, '--', shift.date, format_time(new_lunch.lunch_start),'\n')
+    return True
+
+@metrics.timed('end_lunch')
+def end_lunch(emp, date, time, announce=True):
+    """ End the open lunch in the employee's shift on this date. Returns True if the punch was recorded. """
+    time = time_value(date, time)
+    if refuse_punch(emp, 'end_lunch', date):
+        return False
+    shift = store.get_shift(emp.id, date)
+    lunch = next(lunch for lunch in shift.lunches if lunch.lunch_end == None)
+    old_shift_totals = shift_totals(shift)
+    lunch.lunch_end = time
+    store.update_shift_totals(shift, old_shift_totals)
+    save_punch(emp, shift, is_live_shift(shift), at_lunch=False)
+    if announce:
+        print ('\nLUNCH ENDED:', emp.first_name, emp.last_name, '--', shift.date, format_time(lunch.lunch_end),'\n')
+    return True
+
+# Punch functions by name, for punches that don't come from the menus
+PUNCH_ACTIONS = {
+    'start_shift': start_shift,
+    'end_shift': end_shift,
+    'start_break': start_break,
+    'end_break': end_break,
+    'start_lunch': start_lunch,
+    'end_lunch': end_lunch,
+}
+
+def punch_allowed(emp, action, date):
+    """ Check a punch against the employee's current shift, break, and lunch status.
+        These are the same rules the main menu uses to decide which options are valid.
+    """
+    if action == 'start_shift':
+        return emp.shift_active == False and store.get_shift(emp.id, date) == None
+    elif action == 'end_break':
+        return emp.shift_active == True and emp.on_break == True
+    elif action == 'end_lunch':
+        return emp.shift_active == True and emp.at_lunch == True
+    elif action == 'start_break':
+        return emp.shift_active == True and emp.on_break == False
+    elif action == 'start_lunch':
+        return emp.shift_active == True and emp.at_lunch == False
+    elif action == 'end_shift':
+        return emp.shift_active == True and emp.on_break == False and emp.at_lunch == False
+    return False
+
+# One lock per employee, so punches for different employees can be processed at the same time
+employee_locks = {}
+employee_locks_guard = threading.Lock()
+
+def get_employee_lock(emp_id):
+    with employee_locks_guard:
+        if emp_id not in employee_locks:
+            employee_locks[emp_id] = threading.Lock()
+        return employee_locks[emp_id]
+
+def process_punch(emp_id, action, time=None):
+    """ Check and record one punch for an employee, using the same rules as the main menu.
+        Punches for the same employee are applied one at a time, so this can be called from
+        many threads at once.
+        Returns an error message, or None if the punch was recorded.
+    """
+    if time == None:
+        time = datetime.datetime.now()
+    emp = store.get_employee(emp_id)
+    if emp == None:
+        return 'Employee ID not valid.'
+    if action not in PUNCH_ACTIONS:
+        return 'Unknown punch: ' + str(action)
+
+    with get_employee_lock(emp_id):
+        date = time.strftime("%x")
+        if not punch_allowed(emp, action, date):
+            return 'Punch not allowed for current shift status.'
+        if not PUNCH_ACTIONS[action](emp, date, int(time.timestamp())):
+            return 'Punch could not be recorded.'
+    return None
+
+# Main menu options that record a punch for the current employee, with the message shown if
+# the punch isn't allowed right now
+MAIN_MENU_PUNCHES = {
+    '1': ('start_shift', '\nThere is already a shift for this employee on this date.\n'),
+    '2': ('end_break', '\n*** INVALID ENTRY ***\n'),
+    '3': ('end_lunch', '\n*** INVALID ENTRY ***\n'),
+    '4': ('start_break', '\n*** INVALID ENTRY ***\n'),
+    '5': ('start_lunch', '\n*** INVALID ENTRY ***\n'),
+    '6': ('end_shift', '\n*** INVALID ENTRY ***\n'),
+}
 
 def process_main_menu_input(user_input):
-    time = datetime.datetime.now()
-    # Main menu Option 1 - Start Shift (current employee)
-    if user_input == '1':
-        # Make sure there isn't already a shift for this day (active or complete)
-        all_emp_shifts = [shift for shift in shifts if shift['emp_id'] == current_employee['id'] and shift['date'] == time.strftime("%x")]
-        if len(all_emp_shifts) > 0 or current_employee['shift_active'] == True:
-            print('\nThere is already a shift for this employee on this date.\n')
-            show_main_menu()
-        else:
-            start_shift(current_employee, time.strftime("%x"), time.strftime("%X"))
-            current_employee['shift_active'] = True
-            show_main_menu()
-
-    # Main menu Option 2 - End Break (current employee)
-    elif user_input == '2':
-        if current_employee['on_break'] == False or current_employee['shift_active'] == False:
-            print('\n*** INVALID ENTRY ***\n')
-            show_main_menu()
-        else:
-            end_break(current_employee, time.strftime("%x"), time.strftime("%X"))
-            current_employee['on_break'] = False
-            show_main_menu()
-
-    # Main menu Option 3 - End Lunch (current employee)
-    elif user_input == '3':
-        if current_employee['at_lunch'] == False or current_employee['shift_active'] == False:
-            print('\n*** INVALID ENTRY ***\n')
-            show_main_menu()
-        else:
-            end_lunch(current_employee, time.strftime("%x"), time.strftime("%X"))
-            current_employee['at_lunch'] = False
-            show_main_menu()
-
-    # Main menu Option 4 - Start Break (current employee)
-    elif user_input == '4':
-        if current_employee['on_break'] == True or current_employee['shift_active'] == False:
-            print('\n*** INVALID ENTRY ***\n')
-            show_main_menu()
-        else:
-            start_break(current_employee, time.strftime("%x"), time.strftime("%X"))
-            current_employee['on_break'] = True
-            show_main_menu()
-
-    # Main menu Option 5 - Start Lunch (current employee)
-    elif user_input == '5':
-        if current_employee['at_lunch'] == True or current_employee['shift_active'] == False:
-            print('\n*** INVALID ENTRY ***\n')
-            show_main_menu()
+    """ Carry out a main menu option. Returns the next menu to show. """
+    # Main menu Options 1 to 6 - punches (current employee)
+    if user_input in MAIN_MENU_PUNCHES:
+        action, not_allowed_message = MAIN_MENU_PUNCHES[user_input]
+        time = datetime.datetime.now()
+        if not punch_allowed(current_employee, action, time.strftime("%x")):
+            print(not_allowed_message)
         else:
-            start_lunch(current_employee, time.strftime("%x"), time.strftime("%X"))
-            current_employee['at_lunch'] = True
-            show_main_menu()
-
-    # Main menu Option 6 - End Shift (current employee)
-    elif user_input == '6':
-        if current_employee['shift_active'] == False or\
-            current_employee['on_break'] == True or current_employee['at_lunch'] == True:
-            print('\n*** INVALID ENTRY ***\n')
-            show_main_menu()
-        else:
-            end_shift(current_employee, time.strftime("%x"), time.strftime("%X"))
-            current_employee['shift_active'] = False
-            show_main_menu()
+            PUNCH_ACTIONS[action](current_employee, time.strftime("%x"), int(time.timestamp()))
+        return 'main'
 
     # Main menu Option 8 - display administrator menu
     elif user_input == '8':
-        show_admin_menu()
+        return 'admin'
 
     # Main menu Option 9 - sign out
     elif user_input == '9':
-        print('\nSigning out. Goodbye,', current_employee['first_name'] + '!\n')
-        show_start_menu()
+        print('\nSigning out. Goodbye,', current_employee.first_name + '!\n')
+        return 'start'
 
     # Invalid input
     else:
         print('\n*** INVALID ENTRY ***\n')
-        show_main_menu()
+        return 'main'
 
-def process_admin_task(option):
-    # Admin menu Option 1 - adjust time clock punch
-    if option == '1':
-        selected_emp_id = input("\nPlease enter an Employee ID: ")
-        if validate_emp_id(selected_emp_id) == True:
-            selected_employee = [employee for employee in employees if selected_emp_id == employee['id']][0]
-            admin_adjust_time(selected_employee)
-        else:
-            print("No user with that id.\n")
-            show_admin_menu()
-
-    # Admin menu Option 2 - display shift report
-    elif option == '2':
-        selected_emp_id = input("\nPlease enter an employee's ID to see their shift report: ")
-        if validate_emp_id(selected_emp_id) == True:
-            display_shift_report(selected_emp_id)
-        else:
-            print("No user with that id.\n")
-            show_admin_menu()
-
-    # Admin menu Option 3 - change employee profile
-    elif option == '3':
-        selected_emp_id = input("\nPlease enter an employee's ID to update their profile: ")
-        if validate_emp_id(selected_emp_id) == True:
-            update_profile(selected_emp_id)
-        else:
-            print("No user with that id.\n")
-            show_admin_menu()
+# Most employees listed by a name search
+EMPLOYEE_SEARCH_LIMIT = 20
 
-    # Admin menu Option 4 - Go back to main menu
-    elif option == '4':
-        show_main_menu()
+def select_employee(prompt):
+    """ Ask for an employee ID, or the start of an employee's name. If more than one employee's
+        name matches, they are listed and the ID is asked for.
+        Returns the employee, or None if there is no such employee.
+    """
+    selected = menu_input(prompt)
+    employee = store.get_employee(selected)
+    if employee != None:
+        return employee
 
-    else:
+    matches = store.find_employees(selected, EMPLOYEE_SEARCH_LIMIT)
+    if len(matches) == 1:
+        print('\nFound', matches[0].id, matches[0].first_name, matches[0].last_name)
+        return matches[0]
+    if len(matches) > 1:
+        print_employees(matches)
+        selected = menu_input("Please enter one of these Employee IDs: ")
+    employee = validate_emp_id(selected)
+    if employee == None:
+        print("No user with that id.\n")
+    return employee
+
+def print_employees(employees):
+    print()
+    for employee in employees:
+        print('\t' + employee.id.ljust(10), employee.first_name, employee.last_name + (' (admin)' if employee.is_admin else ''))
+    if len(employees) == EMPLOYEE_SEARCH_LIMIT:
+        print('\t(only the first', EMPLOYEE_SEARCH_LIMIT, 'shown)')
+    print()
+
+# Admin menu Option 1 - adjust time clock punch
+def adjust_time_task():
+    selected_employee = select_employee("\nPlease enter an Employee ID or name: ")
+    if selected_employee != None:
+        admin_adjust_time(selected_employee)
+    return 'admin'
+
+# Admin menu Option 2 - display shift report
+def shift_report_task():
+    emp_ids = menu_input("\nEnter employee IDs separated by commas (blank for everyone): ")
+    emp_ids = [emp_id.strip() for emp_id in emp_ids.split(',') if emp_id.strip() != '']
+    unknown_emp_ids = store.unknown_emp_ids(emp_ids)
+    if len(unknown_emp_ids) > 0:
+        print("No user with that id:", ', '.join(unknown_emp_ids), "\n")
+        return 'admin'
+
+    try:
+        first_date = menu_input('\nEnter first date (MM/DD/YY, blank for no limit): ')
+        first_day = datetime.datetime.strptime(first_date, "%x").toordinal() if first_date != '' else None
+        last_date = menu_input('\nEnter last date (MM/DD/YY, blank for no limit): ')
+        last_day = datetime.datetime.strptime(last_date, "%x").toordinal() if last_date != '' else None
+    except ValueError:
+        print('\n*** INVALID DATE ***\n')
+        return 'admin'
+
+    print('\nPRESS 1 for every shift')
+    print('PRESS 2 for shifts that are still open')
+    print('PRESS 3 for shifts with a break or lunch that was never ended\n')
+    shift_filter = menu_input()
+    if shift_filter not in ['1', '2', '3']:
         print('\n*** INVALID ENTRY ***\n')
-        show_admin_menu()
+        return 'admin'
+    shifts = store.query_shifts(emp_ids or None, first_day, last_day,
+        open_only=shift_filter == '2', unfinished_only=shift_filter == '3')
+
+    report_file_name = menu_input('\nEnter a file name to save the report in (blank to show it here): ')
+    if report_file_name == '':
+        print('\nSHIFT REPORT\n')
+        write_shift_report(shifts)
+        menu_input('\nPress Enter to continue\n')
+        return 'admin'
+    try:
+        with open(report_file_name, 'w') as report_file:
+            shift_count = write_shift_report(shifts, report_file)
+        print('\n' + str(shift_count), 'shifts written to', report_file_name, '\n')
+    except OSError as error:
+        print('\nERROR: Could not write', report_file_name, '-', error.strerror, '\n')
+    return 'admin'
+
+# Admin menu Option 3 - change employee profile
+def update_profile_task():
+    selected_employee = select_employee("\nPlease enter an employee's ID or name to update their profile: ")
+    if selected_employee != None:
+        update_profile(selected_employee.id)
+    return 'admin'
+
+# Admin menu Option 4 - Go back to main menu
+def main_menu_task():
+    return 'main'
+
+# Admin menu Option 5 - export payroll hours
+def export_payroll_task():
+    first_date = menu_input('\nEnter first date of pay period (MM/DD/YY): ')
+    last_date = menu_input('\nEnter last date of pay period (MM/DD/YY): ')
+    csv_file_name = menu_input('\nEnter CSV file name: ')
+    try:
+        employee_count = export_payroll_hours(first_date, last_date, csv_file_name)
+        print('\nHours for', employee_count, 'employees written to', csv_file_name, '\n')
+    except ValueError:
+        print('\n*** INVALID DATE ***\n')
+    except OSError as error:
+        print('\nERROR: Could not write', csv_file_name, '-', error.strerror, '\n')
+    return 'admin'
+
+# Admin menu Option 6 - import punches from a file
+def import_punches_task():
+    file_name = menu_input('\nEnter CSV or JSONL file name: ')
+    try:
+        import_punches(file_name)
+    except OSError as error:
+        print('\nERROR: Could not read', file_name, '-', error.strerror, '\n')
+    except ValueError:
+        print('\nERROR:', file_name, 'is not a punch file.\n')
+    return 'admin'
+
+# Admin menu Option 7 - view performance metrics
+def view_metrics_task():
+    print('\n' + metrics.as_text())
+    return 'admin'
+
+# Admin menu Option 8 - see who is clocked in
+def active_state_task():
+    print_active_state(active_state())
+    return 'admin'
+
+# Admin menu Option 9 - find an employee by name
+def find_employee_task():
+    name = menu_input('\nEnter the start of a first name, last name, or full name: ')
+    matches = store.find_employees(name, EMPLOYEE_SEARCH_LIMIT)
+    if len(matches) == 0:
+        print('\nNo employees found.\n')
+    else:
+        print_employees(matches)
+    return 'admin'
+
+ADMIN_TASKS = {
+    '1': adjust_time_task,
+    '2': shift_report_task,
+    '3': update_profile_task,
+    '4': main_menu_task,
+    '5': export_payroll_task,
+    '6': import_punches_task,
+    '7': view_metrics_task,
+    '8': active_state_task,
+    '9': find_employee_task,
+}
+
+def process_admin_task(option):
+    """ Carry out an admin menu option. Returns the next menu to show. """
+    if option in ADMIN_TASKS:
+        return ADMIN_TASKS[option]()
+    print('\n*** INVALID ENTRY ***\n')
+    return 'admin'
+
+# Admin time adjustment options and the punch each one records
+ADJUST_TIME_PUNCHES = {
+    '1': 'start_shift',
+    '2': 'end_shift',
+    '3': 'start_break',
+    '4': 'end_break',
+    '5': 'start_lunch',
+    '6': 'end_lunch',
+}
 
 def admin_adjust_time(emp):
     """ Admin can manually enter time clock data for employees. """
 
-    print('\nADJUST TIME CLOCK DATA FOR', emp['first_name'], emp['last_name'])
+    print('\nADJUST TIME CLOCK DATA FOR', emp.first_name, emp.last_name)
     print('\nPRESS 1 to start a shift')
     print('PRESS 2 to end a shift')
     print('PRESS 3 to start a break')
@@ -394,110 +2396,954 @@ def admin_adjust_time(emp):
     print('PRESS 6 to end a lunch')
     print('PRESS 9 to go back to Admin menu\n')
 
-    option = input()
+    option = menu_input()
 
     def get_date_time():
-        date = input('\nEnter date (MM/DD/YY): ')
-        time = input('\nEnter time (HH:MM:SS): ')
-        if date != "" and time != "":
-            return {date, time}
-        else:
+        date = menu_input('\nEnter date (MM/DD/YY): ')
+        time = menu_input('\nEnter time (HH:MM:SS): ')
+        if date == "" or time == "":
             print('\nDate and/or time input was blank. Operation cancelled.\n')
-            return {'date': "", 'time': ""}
+            return "", ""
+        try:
+            parse_time(date, time)
+        except ValueError:
+            print('\n*** INVALID DATE OR TIME ***\n')
+            return "", ""
+        # Written the way the time clock writes dates (8/10/22 becomes 08/10/22), so the shift
+        # is found under the same date as the rest of that day's punches
+        return day_to_date(date_sort_key(date)), time
 
-    # Start shift
-    if option == '1':
-        date, time = get_date_time()
-        if date != "" and time != "":
-            start_shift(emp, date, time)
-    elif option == '2':
-        date, time = get_date_time()
-        if date != "" and time != "":
-            end_shift(emp, date, time)
-    elif option == '3':
-        date, time = get_date_time()
-        if date != "" and time != "":
-            start_break(emp, date, time)
-    elif option == '4':
-        date, time = get_date_time()
-        if date != "" and time != "":
-            end_break(emp, date, time)
-    elif option == '5':
+    if option in ADJUST_TIME_PUNCHES:
         date, time = get_date_time()
         if date != "" and time != "":
-            start_lunch(emp, date, time)
-    elif option == '6':
-        date, time = get_date_time()
-        if date != "" and time != "":
-            end_lunch(emp, date, time)
-    else:
+            PUNCH_ACTIONS[ADJUST_TIME_PUNCHES[option]](emp, date, time)
+    elif option != '9':
         print('\n*** INVALID ENTRY ***\n')
 
-    show_admin_menu()
-
 def register():
     """ Enter id, first name, and last name to register as new user """
 
-    id_num = input('Please enter Employee ID number: ')
-    first = input('First name: ')
-    last = input('Last name: ')
-    if id_num != "" and first != "" and last != "":
-        new_user = Employee(id_num, first, last).__dict__
-        employees.append(new_user)
-        update_data_file()
-        return new_user
+    id_num = menu_input('Please enter Employee ID number: ')
+    first = menu_input('First name: ')
+    last = menu_input('Last name: ')
+    error = register_employee(id_num, first, last)
+    if error != None:
+        print('\n' + error)
+    else:
+        return store.get_employee(id_num)
+
+def register_employee(emp_id, first_name, last_name):
+    """ Add a new employee. Returns an error message, or None if the employee was added. """
+    if emp_id == "" or first_name == "" or last_name == "":
+        return 'Some of your input was blank.'
+    with get_employee_lock(emp_id):
+        if store.get_employee(emp_id) != None:
+            return 'Employee ID ' + emp_id + ' is already registered.'
+        new_user = Employee(emp_id, first_name, last_name)
+        store.add_employee(new_user)
+        update_data_file(new_user)
+    return None
 
 def update_profile(emp_id):
-    employee = [emp for emp in employees if emp['id'] == emp_id][0]
-    print('\nCHANGE PROFILE FOR', employee['first_name'], employee['last_name'])
+    employee = store.get_employee(emp_id)
+    print('\nCHANGE PROFILE FOR', employee.first_name, employee.last_name)
 
-    answer = input('\nUpdate first name (y/n)? ')
+    answer = menu_input('\nUpdate first name (y/n)? ')
     if answer == 'Y' or answer == 'y':
-        employee['first_name'] = input('\nEnter new first name: ')
+        employee.first_name = menu_input('\nEnter new first name: ')
         print('\nFIRST NAME UPDATED')
 
-    answer = input('\nUpdate last name (y/n)? ')
+    answer = menu_input('\nUpdate last name (y/n)? ')
     if answer == 'Y' or answer == 'y':
-        employee['last_name'] = input('\nEnter new last name: ')
+        employee.last_name = menu_input('\nEnter new last name: ')
         print('\nLAST NAME UPDATED')
 
-    answer = input('\nUpdate admin status (y/n)? ')
+    answer = menu_input('\nUpdate admin status (y/n)? ')
     if answer == 'Y' or answer == 'y':
-        status = input('\nGive this employee admin status (y/n)? ')
+        status = menu_input('\nGive this employee admin status (y/n)? ')
         if status == 'Y' or status == 'y':
-            employee['is_admin'] = True
+            employee.is_admin = True
         else:
-            employee['is_admin'] = False
+            employee.is_admin = False
         print('\nADMIN STATUS UPDATED\n')
 
-    update_data_file()
-    print('\nEmployee: ', employee['first_name'], employee['last_name'], '\nAdmin status:', employee['is_admin'],'\n')
-    show_admin_menu()
+    # Added again so the name index picks up a changed name
+    store.add_employee(employee)
+    update_data_file(employee)
+    print('\nEmployee: ', employee.first_name, employee.last_name, '\nAdmin status:', employee.is_admin,'\n')
 
 def display_shift_report(emp_id):
-    employee = [emp for emp in employees if emp['id'] == emp_id][0]
-    employee_shifts = [shift for shift in shifts if shift['emp_id'] == emp_id]
-
-    print('\nSHIFT REPORT FOR', employee['first_name'], employee['last_name'] + ':\n')
-    for shift in employee_shifts:
-        print('\tDate:', shift['date'])
-        print('\tShift Start:', shift['shift_start'], '--> Shift End:', shift['shift_end'])
-        print('\t\tLunches: (', len(shift['lunches']),')')
-        if len(shift['lunches']) > 0:
-            for lunch in shift['lunches']:
-                print('\t\t\tLunch Start:', lunch['lunch_start'], '--> Lunch End:', lunch['lunch_end'])
-        print('\t\tBreaks: (', len(shift['breaks']),')')
-        if len(shift['breaks']) > 0:
-            for brk in shift['breaks']:
-                print('\t\t\tBreak Start:', brk['break_start'], '--> Break End:', brk['break_end'])
-        print('\t-------------------------------------------------')
-    
-    print('END OF REPORT')
-    input('\nPress Enter to continue\n')
-    show_admin_menu()
+    employee = store.get_employee(emp_id)
+
+    print('\nSHIFT REPORT FOR', employee.first_name, employee.last_name + ':\n')
+    write_shift_report(store.query_shifts(emp_ids=[emp_id]), show_employee=False)
+    menu_input('\nPress Enter to continue\n')
+
+# Shifts shown on the screen before the report pauses
+REPORT_PAGE_SIZE = 20
+
+def write_shift_report(shifts, report_file=None, show_employee=True):
+    """ Write each shift as it comes, to the screen or to a file. On the screen the report
+        pauses after every REPORT_PAGE_SIZE shifts and can be stopped there.
+        Returns the number of shifts written.
+    """
+    shift_count = 0
+    for shift in shifts:
+        if report_file == None and shift_count > 0 and shift_count % REPORT_PAGE_SIZE == 0:
+            if menu_input('\nPress Enter for more, or Q to stop\n').strip().lower() == 'q':
+                return shift_count
+        if show_employee:
+            employee = store.get_employee(shift.emp_id)
+            name = employee.first_name + ' ' + employee.last_name if employee != None else ''
+            print('\tEmployee:', shift.emp_id, name, file=report_file)
+        print('\tDate:', shift.date, file=report_file)
+        print('\tShift Start:', format_time(shift.shift_start), '--> Shift End:', format_time(shift.shift_end), file=report_file)
+        print('\t\tLunches: (', len(shift.lunches),')', file=report_file)
+        if len(shift.lunches) > 0:
+            for lunch in shift.lunches:
+                print('\t\t\tLunch Start:', format_time(lunch.lunch_start), '--> Lunch End:', format_time(lunch.lunch_end), file=report_file)
+        print('\t\tBreaks: (', len(shift.breaks),')', file=report_file)
+        if len(shift.breaks) > 0:
+            for brk in shift.breaks:
+                print('\t\t\tBreak Start:', format_time(brk.break_start), '--> Break End:', format_time(brk.break_end), file=report_file)
+        print('\t-------------------------------------------------', file=report_file)
+        shift_count += 1
+
+    print('END OF REPORT', file=report_file)
+    return shift_count
+
+### BULK PUNCH IMPORT ###
+# Punches from badge readers, or corrections for many employees, can be loaded from a file
+# instead of being entered one at a time through the admin menu.
+
+# Fields every punch in a punch file has
+PUNCH_FIELDS = ['emp_id', 'action', 'date', 'time']
+
+def read_punch_file(file_name):
+    """ Read punches from a CSV file (with a header row of emp_id, action, date, time) or a
+        json lines file (one {"emp_id", "action", "date", "time"} object per line).
+        Dates are MM/DD/YY and times are HH:MM:SS, as in the admin menu.
+    """
+    with open(file_name, "r", newline='') as punch_file:
+        if file_name.endswith('.jsonl') or file_name.endswith('.json'):
+            return [json.loads(line) for line in punch_file if line.strip() != '']
+        return list(csv.DictReader(punch_file))
+
+def apply_punches(punches):
+    """ Check and record many punches, saving them all in one write.
+        Punches are applied in date and time order, using the same functions (and so the same
+        rules, see punch_refusal()) as the admin menu's time adjustments. Punches that break the
+        rules are skipped. Punches for past days don't change whether an employee is on the clock now.
+        Returns a list of (position in punches, reason) for every punch that was skipped.
+    """
+    rejected = []
+    # A json lines file can hold any json on a line, so rows are checked for the fields first
+    punch_rows = []
+    for position, punch in enumerate(punches):
+        if not isinstance(punch, dict):
+            rejected.append((position, 'Not a punch.'))
+            continue
+        # Missing fields (None in a short CSV row) are left empty, and fail the checks below
+        field = next((field for field in PUNCH_FIELDS if not isinstance(punch.get(field), (str, type(None)))), None)
+        if field != None:
+            rejected.append((position, field + ' must be a string.'))
+        else:
+            punch_rows.append((position, {field: punch.get(field) or '' for field in PUNCH_FIELDS}))
+
+    checked_punches = []
+    unknown_emp_ids = set(store.unknown_emp_ids({punch['emp_id'] for position, punch in punch_rows}))
+    for position, punch in punch_rows:
+        emp_id = punch['emp_id']
+        action = punch['action']
+        date = punch['date']
+        try:
+            punch_time = parse_time(date, punch['time'])
+        except ValueError:
+            rejected.append((position, 'Date or time not valid.'))
+            continue
+        if emp_id in unknown_emp_ids:
+            rejected.append((position, 'Employee ID not valid.'))
+        elif action not in PUNCH_ACTIONS:
+            rejected.append((position, 'Unknown punch: ' + str(action)))
+        else:
+            # Dates are written the way the time clock writes them, e.g. 1/2/24 becomes 01/02/24
+            checked_punches.append((punch_time, position, emp_id, day_to_date(date_sort_key(date)), action))
+
+    checked_punches.sort()
+    with batched_writes():
+        for punch_time, position, emp_id, date, action in checked_punches:
+            emp = store.get_employee(emp_id)
+            # Checked against the shift on the punch's date, as the punches before it left it
+            reason = punch_refusal(emp, action, date)
+            if reason != None:
+                rejected.append((position, reason))
+            else:
+                PUNCH_ACTIONS[action](emp, date, punch_time, announce=False)
+
+    rejected.sort()
+    return rejected
+
+def import_punches(file_name):
+    """ Record the punches in a file and print a summary, including any punches that were skipped. """
+    punches = read_punch_file(file_name)
+    rejected = apply_punches(punches)
+    print('\nIMPORTED', len(punches) - len(rejected), 'of', len(punches), 'punches from', file_name)
+    for position, reason in rejected:
+        punch = punches[position]
+        if isinstance(punch, dict):
+            punch = ' '.join(str(punch.get(field)) for field in PUNCH_FIELDS)
+        print('\tSkipped punch', position + 1, '(' + str(punch) + '):', reason)
+    print()
+
+### PAYROLL HOURS ###
+# Hours for a pay period are calculated from shifts held column by column in arrays of epoch
+# seconds, rather than from one object per shift, so every employee's hours come from one pass.
+
+class ShiftColumns:
+    """ Shift, break, and lunch times held in parallel arrays. Employee ids are stored once and
+        shifts refer to them by position; breaks and lunches refer to their shift by position.
+    """
+    def __init__(self):
+        self.emp_ids = []
+        self.emp_positions = {}
+        self.shift_emp = array.array('I')
+        self.shift_start = array.array('q')
+        self.shift_end = array.array('q')
+        self.period_shift = array.array('I')
+        self.period_start = array.array('q')
+        self.period_end = array.array('q')
+        self.period_is_lunch = array.array('b')
+
+    def emp_position(self, emp_id):
+        if emp_id not in self.emp_positions:
+            self.emp_positions[emp_id] = len(self.emp_ids)
+            self.emp_ids.append(emp_id)
+        return self.emp_positions[emp_id]
+
+    def add_period(self, start, end, is_lunch):
+        self.period_shift.append(len(self.shift_emp) - 1)
+        self.period_start.append(start)
+        self.period_end.append(end)
+        self.period_is_lunch.append(is_lunch)
+
+    def add_shift(self, shift, day):
+        """ Add a shift. Times that can't be parsed are treated as missing. """
+        def epoch(time):
+            return time if isinstance(time, int) else NO_TIME
+
+        self.shift_emp.append(self.emp_position(shift.emp_id))
+        self.shift_start.append(epoch(shift.shift_start))
+        self.shift_end.append(epoch(shift.shift_end))
+        for brk in shift.breaks:
+            self.add_period(epoch(brk.break_start), epoch(brk.break_end), 0)
+        for lunch in shift.lunches:
+            self.add_period(epoch(lunch.lunch_start), epoch(lunch.lunch_end), 1)
+
+    def add_records(self, emp_id, records, offset, count, first_day, last_day, skip):
+        """ Add one employee's packed archive records (see ARCHIVE_SHIFT) that fall between two
+            days, except those whose (emp_id, day) is in skip.
+        """
+        emp_position = None
+        for i in range(count):
+            day, start, end, break_count, lunch_count = ARCHIVE_SHIFT.unpack_from(records, offset)
+            offset += ARCHIVE_SHIFT.size
+            period_count = break_count + lunch_count
+            if day < first_day or day > last_day or (emp_id, day) in skip:
+                offset += period_count * ARCHIVE_PERIOD.size
+                continue
+            if emp_position == None:
+                emp_position = self.emp_position(emp_id)
+            self.shift_emp.append(emp_position)
+            self.shift_start.append(start)
+            self.shift_end.append(end)
+            for j in range(period_count):
+                start, end = ARCHIVE_PERIOD.unpack_from(records, offset)
+                offset += ARCHIVE_PERIOD.size
+                self.add_period(start, end, 1 if j >= break_count else 0)
+
+def compute_hours(columns):
+    """ Total up completed shifts for every employee in a ShiftColumns.
+        Returns a dict of employee id to a dict of 'shifts', 'open_shifts', and seconds of
+        'shift', 'break', 'lunch', and 'worked' time (shift time less breaks and lunches).
+        Shifts that haven't ended, and breaks or lunches that haven't ended, aren't counted.
+    """
+    emp_count = len(columns.emp_ids)
+    shift_count = [0] * emp_count
+    open_count = [0] * emp_count
+    shift_seconds = [0] * emp_count
+    break_seconds = [0] * emp_count
+    lunch_seconds = [0] * emp_count
+
+    for emp_position, start, end in zip(columns.shift_emp, columns.shift_start, columns.shift_end):
+        if start == NO_TIME or end == NO_TIME:
+            open_count[emp_position] += 1
+        else:
+            shift_count[emp_position] += 1
+            if end > start:
+                shift_seconds[emp_position] += end - start
+
+    for shift_position, start, end, is_lunch in zip(columns.period_shift, columns.period_start,
+        columns.period_end, columns.period_is_lunch):
+        if start == NO_TIME or end <= start or columns.shift_end[shift_position] == NO_TIME:
+            continue
+        emp_position = columns.shift_emp[shift_position]
+        if is_lunch:
+            lunch_seconds[emp_position] += end - start
+        else:
+            break_seconds[emp_position] += end - start
+
+    hours = {}
+    for emp_position, emp_id in enumerate(columns.emp_ids):
+        hours[emp_id] = {'shifts': shift_count[emp_position], 'open_shifts': open_count[emp_position],
+            'shift': shift_seconds[emp_position], 'break': break_seconds[emp_position],
+            'lunch': lunch_seconds[emp_position],
+            'worked': shift_seconds[emp_position] - break_seconds[emp_position] - lunch_seconds[emp_position]}
+    return hours
+
+def export_payroll_hours(first_date, last_date, csv_file_name):
+    """ Write every employee's hours between two dates (formatted with "%x", inclusive) to a
+        CSV file. Returns the number of employees written.
+    """
+    first_day = datetime.datetime.strptime(first_date, "%x").toordinal()
+    last_day = datetime.datetime.strptime(last_date, "%x").toordinal()
+    columns = ShiftColumns()
+    storage.collect_shifts(columns, first_day, last_day)
+    hours = compute_hours(columns)
+
+    with open(csv_file_name, "w", newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['Employee ID', 'First Name', 'Last Name', 'Shifts', 'Open Shifts',
+            'Shift Hours', 'Break Hours', 'Lunch Hours', 'Worked Hours'])
+        for emp_id in sorted(hours):
+            employee = store.get_employee(emp_id)
+            # Shifts can outlive their employee's record (for example in merged site data)
+            first_name = employee.first_name if employee != None else ''
+            last_name = employee.last_name if employee != None else ''
+            emp_hours = hours[emp_id]
+            writer.writerow([emp_id, first_name, last_name, emp_hours['shifts'],
+                emp_hours['open_shifts'], round(emp_hours['shift'] / 3600, 2), round(emp_hours['break'] / 3600, 2),
+                round(emp_hours['lunch'] / 3600, 2), round(emp_hours['worked'] / 3600, 2)])
+    return len(hours)
+
+### MULTI-SITE DATA ###
+# Each site's kiosk can keep its data in its own directory under time_clock_sites (run with
+# --site NAME), and the sites' data is merged into one copy (run with --merge-sites) so hours
+# and reports can be worked out across every site.
+
+SITES_DIR_NAME = "time_clock_sites"
+# Sites are read in separate processes once there is at least this much data to read
+MERGE_POOL_BYTES = 8 * 1024 * 1024
+
+def site_directory(site):
+    return os.path.join(SITES_DIR_NAME, site)
+
+def site_names():
+    """ Return the names of the sites that have a directory, in order. """
+    if not os.path.isdir(SITES_DIR_NAME):
+        return []
+    return sorted(name for name in os.listdir(SITES_DIR_NAME) if os.path.isdir(site_directory(name)))
+
+def read_site(directory):
+    """ Read every employee and shift in the json data files in a directory (its snapshot,
+        journal, and archive), without changing the files.
+        Returns the employees, and the shifts sorted by employee id and day.
+    """
+    site_storage = JsonStorage(directory=directory)
+    employees = {}
+    shifts = {}
+    # Archived shifts go in first, so newer copies in the snapshot or journal replace them
+    for month in site_storage.archive_months():
+        for shift in site_storage.read_archive(month):
+            shifts[(shift.emp_id, shift.date)] = shift
+    snapshot_file_name, imported_data = site_storage.read_newest_snapshot()
+    if imported_data != None:
+        for employee_data in imported_data['employees']:
+            employee = Employee.from_dict(employee_data)
+            employees[employee.id] = employee
+        for shift_data in imported_data['shifts']:
+            shift = Shift.from_dict(shift_data)
+            shifts[(shift.emp_id, shift.date)] = shift
+    site_storage.store = TimeClockStore()
+    site_storage.replay_journals(imported_data.get('journal_segment', 1) if imported_data != None else 1, repair=False)
+    for employee in site_storage.store.all_employees():
+        employees[employee.id] = employee
+    for shift in site_storage.store.all_shifts():
+        shifts[(shift.emp_id, shift.date)] = shift
+
+    shifts = list(shifts.values())
+    shifts.sort(key=lambda shift: (shift.emp_id, shift.day))
+    return list(employees.values()), shifts
+
+def describe_shift(shift):
+    return (str(format_time(shift.shift_start)) + ' - ' + str(format_time(shift.shift_end)) + ', ' +
+        str(len(shift.breaks)) + ' breaks, ' + str(len(shift.lunches)) + ' lunches')
+
+@metrics.timed('merge_sites')
+def merge_sites(sites, directory=''):
+    """ Merge the json data of some sites into the data in a directory (by default the current
+        one), which should not be in use by a running time clock while this runs.
+        Each site's shifts are read sorted by employee and day, in separate processes when there
+        is a lot to read, and merged in one pass. Data already merged into the directory is
+        kept, but a site's copy of a shift replaces it. If the directory is itself a site's, its
+        data is that site's own, so it is ranked as the first site instead.
+        There is one shift per employee per day, so when sites hold different shifts for the
+        same employee and day, the shift from the site listed first is kept and the rest are
+        reported as conflicts. Each employee's record (and so their current status) is taken
+        from the site with their newest shift.
+        Returns the number of conflicts.
+    """
+    target = os.path.normpath(directory or os.curdir)
+    names = [site for site in sites if os.path.normpath(site_directory(site)) != target]
+    if os.path.dirname(target) == SITES_DIR_NAME:
+        # A site's own shifts come first, so a site that differs is reported as a conflict
+        names.insert(0, os.path.basename(target))
+        directories = [site_directory(site) for site in names]
+    else:
+        # The data already merged into the directory is read last, so every site comes before it
+        directories = [site_directory(site) for site in names] + [directory]
+        names.append(None)
+
+    workers = min(len(directories), os.cpu_count() or 1)
+    if workers > 1 and sum(directory_size(site_dir) for site_dir in directories) >= MERGE_POOL_BYTES:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            site_data = list(pool.map(read_site, directories))
+    else:
+        site_data = [read_site(site_dir) for site_dir in directories]
+
+    def tagged(position, shifts):
+        for shift in shifts:
+            yield position, shift
+
+    # heapq.merge keeps the order of the sites for the same employee and day
+    merged_shifts = heapq.merge(*[tagged(position, shifts) for position, (employees, shifts) in enumerate(site_data)],
+        key=lambda item: (item[1].emp_id, item[1].day))
+
+    merged_store = TimeClockStore()
+    conflicts = []
+    newest_site = {}
+    for (emp_id, day), versions in itertools.groupby(merged_shifts, key=lambda item: (item[1].emp_id, item[1].day)):
+        versions = list(versions)
+        site_versions = [version for version in versions if names[version[0]] != None]
+        if len(site_versions) == 0:
+            site_versions = versions
+        kept_position, kept_shift = site_versions[0]
+        # Shifts are compared by the same field tuples they are pickled as
+        kept_state = kept_shift.__getstate__()
+        skipped = [version for version in site_versions[1:] if version[1].__getstate__() != kept_state]
+        if len(skipped) > 0:
+            conflicts.append((site_versions[0], skipped))
+        merged_store.add_shift(kept_shift)
+        newest_site[emp_id] = kept_position
+
+    for position, (employees, shifts) in enumerate(site_data):
+        for employee in employees:
+            if merged_store.get_employee(employee.id) == None or newest_site.get(employee.id) == position:
+                merged_store.add_employee(employee)
+    merged_store.rebuild_totals(merged_store.all_shifts())
+
+    merged_storage = JsonStorage(directory=directory)
+    merged_storage.store = merged_store
+    # Every archived shift was read above, and the archive is rewritten from the merged shifts
+    merged_storage.loaded_months = set(merged_storage.archive_months())
+    merged_storage.write_snapshot()
+    merged_storage.close()
+
+    print('\nMERGED', len([name for name in names if name != None]), 'sites:', len(merged_store.employees_by_id), 'employees and',
+        len(merged_store.shifts_by_emp_date), 'shifts written to', merged_storage.data_file_name)
+    for (kept_position, kept_shift), skipped in conflicts:
+        print('\tConflict for', kept_shift.emp_id, 'on', kept_shift.date + ': kept', names[kept_position],
+            '(' + describe_shift(kept_shift) + ')')
+        for position, shift in skipped:
+            print('\t\tskipped', names[position], '(' + describe_shift(shift) + ')')
+    print()
+    return len(conflicts)
+
+### BENCHMARK ###
+# Measures how long punches, sign-ins, reports, and startup take against a generated data set,
+# so slowdowns in these paths show up as the amount of stored history grows.
+
+def generate_dataset(employee_count, years, storage_type):
+    """ Write a data set of employees who each worked every weekday for some years (up to
+        yesterday), with a break and a lunch in every shift, to the current directory.
+    """
+    generator = random.Random(1)
+    data_store = TimeClockStore()
+    for i in range(employee_count):
+        data_store.add_employee(Employee('B' + str(100000 + i), 'Bench', 'Employee' + str(i)))
+
+    def clock(day, hour, minute):
+        return int((datetime.datetime.combine(day, datetime.time(hour)) + datetime.timedelta(minutes=minute)).timestamp())
+
+    today = datetime.date.today()
+    day = today - datetime.timedelta(days=int(years * 365))
+    while day < today:
+        if day.weekday() < 5:
+            date = day.strftime("%x")
+            for employee in data_store.all_employees():
+                shift = Shift(employee.id, date, clock(day, 8, generator.randint(-10, 10)))
+                shift.breaks.append(Break(clock(day, 10, generator.randint(0, 5)), clock(day, 10, generator.randint(15, 20))))
+                shift.lunches.append(Lunch(clock(day, 12, generator.randint(0, 5)), clock(day, 12, generator.randint(30, 35))))
+                shift.shift_end = clock(day, 16, generator.randint(20, 40))
+                data_store.add_shift(shift)
+        day += datetime.timedelta(days=1)
+    data_store.rebuild_totals(data_store.all_shifts())
+
+    if storage_type == "sqlite":
+        data_storage = SqliteStorage()
+        data_storage.store = data_store
+        data_storage.save_all(data_store.all_employees(), data_store.all_shifts())
+        data_storage.load(TimeClockStore())
+    else:
+        data_storage = JsonStorage()
+        data_storage.store = data_store
+        data_storage.write_snapshot()
+    data_storage.close()
+    return len(data_store.shifts_by_emp_date)
+
+def time_calls(function, calls):
+    """ Call a function once for each tuple of arguments. Returns each call's time in seconds. """
+    latencies = []
+    for arguments in calls:
+        started = time.perf_counter()
+        function(*arguments)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+def print_latencies(name, latencies):
+    latencies = sorted(latencies)
+    def percentile(fraction):
+        return format(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000, '.3f')
+    print('\t' + name.ljust(16), 'p50', percentile(0.5), ' p95', percentile(0.95), ' p99', percentile(0.99),
+        ' max', format(latencies[-1] * 1000, '.3f'), 'ms ', ' throughput', round(len(latencies) / sum(latencies)), 'per second')
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(root, file_name))
+        for root, dir_names, file_names in os.walk(directory) for file_name in file_names)
+
+def run_benchmark(employee_count, years, storage_type):
+    """ Generate a data set in a scratch directory, then time startup, sign-ins, every kind of
+        punch for every employee, and shift reports, and print the results.
+    """
+    global store, menu_input
+
+    original_directory = os.getcwd()
+    scratch_directory = tempfile.TemporaryDirectory(prefix='time_clock_benchmark_')
+    os.chdir(scratch_directory.name)
+    try:
+        print('\nGenerating', employee_count, 'employees with', years, 'years of shifts')
+        started = time.perf_counter()
+        shift_count = generate_dataset(employee_count, years, storage_type)
+        print('\t' + str(shift_count), 'shifts written in', format(time.perf_counter() - started, '.1f'), 'seconds')
+        print('\tData size before punches:', directory_size('.'), 'bytes')
+
+        # Start from an empty store, as a freshly started terminal would
+        store = TimeClockStore()
+        tracemalloc.start()
+        started = time.perf_counter()
+        get_employee_data(storage_type)
+        load_seconds = time.perf_counter() - started
+        load_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        emp_ids = [employee.id for employee in store.all_employees()]
+        now = datetime.datetime.now()
+        date = now.strftime("%x")
+
+        def sign_in(emp_id):
+            validate_emp_id(emp_id)
+
+        def punch(action):
+            function = PUNCH_ACTIONS[action]
+            return lambda emp_id: function(store.get_employee(emp_id), date, int(now.timestamp()))
+
+        results = []
+        report_ids = emp_ids[:min(len(emp_ids), 20)]
+        # Punch output and the report's "Press Enter" prompt aren't part of what's being measured
+        menu_input = lambda prompt='': ''
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            results.append(('sign in', time_calls(sign_in, [(emp_id,) for emp_id in emp_ids])))
+            for action in ['start_shift', 'start_break', 'end_break', 'start_lunch', 'end_lunch', 'end_shift']:
+                results.append((action, time_calls(punch(action), [(emp_id,) for emp_id in emp_ids])))
+                output.seek(0)
+                output.truncate()
+            results.append(('shift report', time_calls(display_shift_report, [(emp_id,) for emp_id in report_ids])))
+            today = now.date().toordinal()
+            results.append(('last week report', time_calls(lambda: write_shift_report(
+                store.query_shifts(first_day=today - 7, last_day=today), io.StringIO()), [()] * 5)))
+            # The first search sorts the name index; the rest use it
+            results.append(('name search', time_calls(lambda name: store.find_employees(name, EMPLOYEE_SEARCH_LIMIT),
+                [('employee' + str(i),) for i in range(min(len(emp_ids), 100))])))
+        menu_input = input
+        close_data_file()
+
+        print('\nBENCHMARK RESULTS (' + storage_type + ' storage)')
+        print('\tStartup:', format(load_seconds * 1000, '.1f'), 'ms, peak traced memory', load_peak, 'bytes')
+        for name, latencies in results:
+            print_latencies(name, latencies)
+        print('\tData size after punches:', directory_size('.'), 'bytes')
+        print('\tPeak process memory:', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, 'KB\n')
+    finally:
+        os.chdir(original_directory)
+        scratch_directory.cleanup()
+
+### WHO IS CLOCKED IN ###
+# Supervisors can watch who is working, on break, or at lunch. The running time clock (or
+# server) keeps a small file listing just the employees on the clock, rewritten at most once a
+# second when something changes, so the dashboard never has to load the employee data itself.
+
+ACTIVE_STATE_FILE_NAME = "time_clock_active.json"
+ACTIVE_STATE_INTERVAL = 1
+
+def active_state():
+    """ The employees on the clock right now, with the time the list was made. """
+    return {'updated': datetime.datetime.now().strftime("%x %X"), 'employees': store.active_employees()}
+
+def write_active_state_file(file_name=ACTIVE_STATE_FILE_NAME):
+    temp_file_name = file_name + '.tmp'
+    with open(temp_file_name, 'w') as active_file:
+        json.dump(active_state(), active_file)
+    os.replace(temp_file_name, file_name)
+
+def start_active_state_file(file_name=ACTIVE_STATE_FILE_NAME):
+    """ Write the active state file now, then from a background thread whenever the active
+        index changes, at most once every ACTIVE_STATE_INTERVAL seconds.
+    """
+    def keep_file_current():
+        written_version = store.active_version
+        while True:
+            time.sleep(ACTIVE_STATE_INTERVAL)
+            if store.active_version != written_version:
+                written_version = store.active_version
+                write_active_state_file(file_name)
+
+    write_active_state_file(file_name)
+    threading.Thread(target=keep_file_current, name='active-state-writer', daemon=True).start()
+    # Leave the file right for the dashboard when the program exits
+    atexit.register(write_active_state_file, file_name)
+
+def print_active_state(state):
+    employees = state['employees']
+    print('\nWHO IS CLOCKED IN (as of ' + state['updated'] + ')')
+    print('\tWorking:', sum(1 for entry in employees if entry['status'] == 'working'),
+        ' On break:', sum(1 for entry in employees if entry['status'] == 'on break'),
+        ' At lunch:', sum(1 for entry in employees if entry['status'] == 'at lunch'), '\n')
+    for entry in employees:
+        status = entry['status'] if entry['status'] == 'working' else entry['status'] + ' since ' + str(entry['since'])
+        print('\t' + entry['id'].ljust(10), entry['name'].ljust(30), ('in at ' + str(entry['shift_start'])).ljust(16), status)
+    print()
+
+def run_dashboard(source):
+    """ Show who is clocked in, refreshed every second, until Ctrl+C is pressed. The list comes
+        from the active state file, or from GET /active when source is a server's URL.
+    """
+    try:
+        while True:
+            try:
+                if source.startswith('http'):
+                    status, state = send_request(source.rstrip('/') + '/active')
+                else:
+                    with open(source) as active_file:
+                        state = json.load(active_file)
+            except (OSError, ValueError):
+                state = None
+
+            # Clear the screen and draw the list again from the top
+            print('\033[2J\033[H', end='')
+            if state == None or 'employees' not in state:
+                print('\nWaiting for the time clock at', source, '...')
+            else:
+                print_active_state(state)
+            print('Press Ctrl+C to stop.')
+            time.sleep(ACTIVE_STATE_INTERVAL)
+    except KeyboardInterrupt:
+        print()
+
+### SERVER MODE ###
+# Many terminals can share one time clock by sending punches to a server over HTTP, instead of
+# each running their own copy of the program against the same data file.
+
+class PunchRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ Handles requests from time clock terminals:
+            GET  /employee?id=<emp_id>     employee status and today's shift
+            GET  /metrics                  operation counts and timings, in Prometheus format
+            GET  /active                   employees on the clock right now
+            GET  /employees?name=...       employees whose name starts with the text
+            POST /punch      {"emp_id": ..., "action": "start_shift" | "end_shift" | ...}
+            POST /register   {"id": ..., "first_name": ..., "last_name": ...}
+            POST /validate   {"ids": [...]}, answered with the ids that aren't an employee's
+    """
+    # Fields of each POST request that must be strings when they are given
+    STRING_FIELDS = {
+        '/punch': ['emp_id', 'action'],
+        '/register': ['id', 'first_name', 'last_name'],
+    }
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/employee':
+            emp_id = urllib.parse.parse_qs(url.query).get('id', [''])[0]
+            emp = store.get_employee(emp_id)
+            if emp == None:
+                self.send_json(404, {'error': 'Employee ID not valid.'})
+            else:
+                with get_employee_lock(emp_id):
+                    shift = store.get_shift(emp_id, datetime.datetime.now().strftime("%x"))
+                    self.send_json(200, {'employee': emp.to_dict(), 'shift': shift.to_dict() if shift != None else None})
+        elif url.path == '/active':
+            self.send_json(200, active_state())
+        elif url.path == '/employees':
+            name = urllib.parse.parse_qs(url.query).get('name', [''])[0]
+            self.send_json(200, {'employees': [employee.to_dict() for employee in store.find_employees(name, EMPLOYEE_SEARCH_LIMIT)]})
+        elif url.path == '/metrics':
+            body = metrics.as_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_json(404, {'error': 'Not found.'})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_json(400, {'error': 'Request body must be json.'})
+            return
+        if not isinstance(request, dict):
+            self.send_json(400, {'error': 'Request body must be a json object.'})
+            return
+        # Ids and names are used as dict keys and written to the archive, so they must be strings
+        for field in self.STRING_FIELDS.get(self.path, []):
+            if not isinstance(request.get(field, ''), str):
+                self.send_json(400, {'error': field + ' must be a string.'})
+                return
+
+        if self.path == '/punch':
+            error = process_punch(request.get('emp_id', ''), request.get('action', ''))
+            if error == None:
+                self.send_json(200, {'employee': store.get_employee(request['emp_id']).to_dict()})
+            else:
+                self.send_json(409, {'error': error})
+        elif self.path == '/validate':
+            emp_ids = request.get('ids')
+            if not isinstance(emp_ids, list) or not all(isinstance(emp_id, str) for emp_id in emp_ids):
+                self.send_json(400, {'error': 'ids must be a list of employee IDs.'})
+            else:
+                self.send_json(200, {'unknown': store.unknown_emp_ids(emp_ids)})
+        elif self.path == '/register':
+            error = register_employee(request.get('id', ''), request.get('first_name', ''), request.get('last_name', ''))
+            if error == None:
+                self.send_json(200, {'employee': store.get_employee(request['id']).to_dict()})
+            else:
+                self.send_json(409, {'error': error})
+        else:
+            self.send_json(404, {'error': 'Not found.'})
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Don't print a line for every punch
+        pass
+
+class PunchServer(http.server.ThreadingHTTPServer):
+    # Let a rush of terminals queue up to connect instead of being turned away
+    request_queue_size = 256
+
+def run_server(host, port):
+    """ Serve punches from many terminals until interrupted. Each request gets its own thread. """
+    server = PunchServer((host, port), PunchRequestHandler)
+    print('Time Clock server listening on http://' + host + ':' + str(port), '(press Ctrl-C to stop)\n')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('\nStopping the Time Clock server.\n')
+    finally:
+        server.server_close()
+
+def send_request(url, data=None):
+    """ Send a request to the time clock server. Returns the response status and json body.
+        If the server can't be reached, the status is 0.
+    """
+    body = None
+    if data != None:
+        body = json.dumps(data).encode()
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read())
+    except (urllib.error.URLError, ConnectionError) as error:
+        return 0, {'error': str(error)}
+
+def run_load_test(url, employee_count, threads):
+    """ Simulate a shift change: many employees each start a shift, take a break and a lunch,
+        and end their shift, with punches sent from many threads at once.
+        Afterwards, check every employee's shift on the server to make sure no punch was lost.
+        Run this against a server using a scratch data file, since it registers test employees.
+    """
+    run_id = datetime.datetime.now().strftime("%H%M%S")
+    emp_ids = ['load-' + run_id + '-' + str(i) for i in range(employee_count)]
+    actions = ['start_shift', 'start_break', 'end_break', 'start_lunch', 'end_lunch', 'end_shift']
+
+    for emp_id in emp_ids:
+        send_request(url + '/register', {'id': emp_id, 'first_name': 'Load', 'last_name': emp_id})
+
+    def punch_all(emp_id):
+        latencies = []
+        failures = 0
+        for action in actions:
+            started = datetime.datetime.now()
+            status, response = send_request(url + '/punch', {'emp_id': emp_id, 'action': action})
+            latencies.append((datetime.datetime.now() - started).total_seconds())
+            if status != 200:
+                failures += 1
+        return emp_id, latencies, failures
+
+    started = datetime.datetime.now()
+    latencies = []
+    failures = 0
+    accepted_emp_ids = []
+    with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+        for emp_id, emp_latencies, emp_failures in pool.map(punch_all, emp_ids):
+            latencies.extend(emp_latencies)
+            failures += emp_failures
+            if emp_failures == 0:
+                accepted_emp_ids.append(emp_id)
+    elapsed = (datetime.datetime.now() - started).total_seconds()
+
+    # Every employee whose punches were all accepted should end with one closed shift holding
+    # one closed break and one closed lunch
+    lost = 0
+    for emp_id in accepted_emp_ids:
+        status, response = send_request(url + '/employee?id=' + urllib.parse.quote(emp_id))
+        shift = response.get('shift')
+        if shift == None or shift['shift_end'] == None or len(shift['breaks']) != 1 or len(shift['lunches']) != 1\
+            or shift['breaks'][0]['break_end'] == None or shift['lunches'][0]['lunch_end'] == None:
+            lost += 1
+
+    latencies.sort()
+    print('\nLOAD TEST RESULTS')
+    print('\tEmployees:', employee_count, ' Threads:', threads)
+    print('\tPunches:', len(latencies), ' Rejected or failed:', failures, ' Employees with lost punches:', lost)
+    print('\tThroughput:', round(len(latencies) / elapsed * 60), 'punches per minute')
+    print('\tLatency (ms): median', round(latencies[len(latencies) // 2] * 1000, 1),
+        ' p95', round(latencies[int(len(latencies) * 0.95)] * 1000, 1),
+        ' max', round(latencies[-1] * 1000, 1), '\n')
 
 ### MAIN PROGRAM ###
-print ('\nTIME CLOCK APPLICATION\n')
-get_employee_data()
-show_start_menu()
+# Only run when started as a script, not when imported (for example by merge_sites()'s worker
+# processes, which import this file when they can't be forked)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time Clock application')
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default='json',
+        help='where employee and shift data is kept (default: json)')
+    parser.add_argument('--migrate-to-sqlite', action='store_true',
+        help='import time_clock_data.json into the SQLite database and exit')
+    parser.add_argument('--payroll', nargs=3, metavar=('FIRST_DATE', 'LAST_DATE', 'CSV_FILE'),
+        help='write every employee\'s hours between two dates (MM/DD/YY) to a CSV file and exit')
+    parser.add_argument('--import-punches', metavar='FILE',
+        help='record the punches in a CSV or JSONL file (emp_id, action, date, time) and exit')
+    parser.add_argument('--serve', action='store_true',
+        help='run a server that records punches sent by many terminals')
+    parser.add_argument('--host', default='127.0.0.1', help='server address (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080, help='server port (default: 8080)')
+    parser.add_argument('--load-test', action='store_true',
+        help='send a rush of punches to a running server and report how it kept up')
+    parser.add_argument('--employees', type=int, default=500,
+        help='employees simulated by --load-test or --benchmark (default: 500)')
+    parser.add_argument('--threads', type=int, default=20, help='threads used by --load-test (default: 20)')
+    parser.add_argument('--benchmark', action='store_true',
+        help='time punches, sign-ins, reports, and startup against a generated data set and exit')
+    parser.add_argument('--years', type=float, default=1, help='years of shifts generated by --benchmark (default: 1)')
+    parser.add_argument('--dashboard', nargs='?', const=ACTIVE_STATE_FILE_NAME, metavar='FILE_OR_URL',
+        help='show who is clocked in, refreshed every second, from the active state file or a server URL')
+    parser.add_argument('--metrics-file', metavar='FILE',
+        help='write operation counts and timings to a file at exit (.json, .prom for Prometheus, or text)')
+    parser.add_argument('--profile', metavar='STATS_FILE',
+        help='profile the run with cProfile and save the stats to a file at exit')
+    parser.add_argument('--site', metavar='NAME',
+        help='keep this site\'s data in its own directory, ' + SITES_DIR_NAME + '/NAME')
+    parser.add_argument('--merge-sites', nargs='*', metavar='SITE',
+        help='merge the json data of these sites (default: every site) into the current directory, '
+        'or into the --site directory, and exit')
+    args = parser.parse_args()
+
+    # Where this time clock's data files are kept
+    data_directory = site_directory(args.site) if args.site else ''
+
+    if args.metrics_file:
+        atexit.register(metrics.write, args.metrics_file)
+
+    if args.profile:
+        start_profiler(args.profile)
+
+    if args.migrate_to_sqlite:
+        migrate_json_to_sqlite(data_directory)
+        quit()
+
+    if args.merge_sites != None:
+        sites = args.merge_sites or [site for site in site_names() if site_directory(site) != data_directory]
+        try:
+            merge_sites(sites, data_directory)
+        except ValueError as error:
+            print('\nERROR:', error, '\n')
+            sys.exit(1)
+        quit()
+
+    if args.dashboard:
+        if args.site and args.dashboard == ACTIVE_STATE_FILE_NAME:
+            args.dashboard = os.path.join(data_directory, ACTIVE_STATE_FILE_NAME)
+        run_dashboard(args.dashboard)
+        quit()
+
+    if args.benchmark:
+        run_benchmark(args.employees, args.years, args.storage)
+        quit()
+
+    if args.load_test:
+        run_load_test('http://' + args.host + ':' + str(args.port), args.employees, args.threads)
+        quit()
+
+    if args.payroll:
+        get_employee_data(args.storage, data_directory)
+        employee_count = export_payroll_hours(*args.payroll)
+        print('Hours for', employee_count, 'employees written to', args.payroll[2])
+        close_data_file()
+        quit()
+
+    if args.import_punches:
+        get_employee_data(args.storage, data_directory)
+        try:
+            import_punches(args.import_punches)
+        except OSError as error:
+            print('\nERROR: Could not read', args.import_punches, '-', error.strerror, '\n')
+            sys.exit(1)
+        except ValueError:
+            print('\nERROR:', args.import_punches, 'is not a punch file.\n')
+            sys.exit(1)
+        finally:
+            close_data_file()
+        quit()
+
+    if args.serve:
+        get_employee_data(args.storage, data_directory)
+        atexit.register(close_data_file)
+        start_active_state_file(os.path.join(data_directory, ACTIVE_STATE_FILE_NAME))
+        run_server(args.host, args.port)
+        quit()
+
+    print ('\nTIME CLOCK APPLICATION\n')
+    get_employee_data(args.storage, data_directory)
+    atexit.register(close_data_file)
+    start_active_state_file(os.path.join(data_directory, ACTIVE_STATE_FILE_NAME))
+    run_menus()
 